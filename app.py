@@ -4,36 +4,49 @@ import math
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-from dash import Dash, dcc, html, dash_table, Input, Output, ctx
+from dash import Dash, dcc, html, dash_table, Input, Output, State, ClientsideFunction, ctx, Patch, no_update
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import pandas as pd
 import numpy as np
-import geojson
 import enum
-
-times_df = pd.read_csv('datasets/times.csv')
+import functools
+import gc
+import logging
+import os
+from store import RankingStore, country_base_metrics, display_frame
+from university_index import load_university_index
+from ingest import RankingIngest, ranking_sources
+from geometry import build_countries_asset
+import dataset_cache
+from figure_cache import FigureCache
+from figure_templates import FigureTemplate
+from table_query import filter_table, sort_table, page_table
+from instrumentation import Metrics, SlowRequestProfiler
+from export import register_export_routes
+from warmup import Warmup
+from movers import align_years, top_movers, rank_metrics
+from memory import process_memory, store_bytes
+from render_versions import RenderVersions
+from http_cache import HttpCache
+
+# directory of the ranking CSVs, the countries geojson and the mapbox token
+datasets_dir = os.environ.get('DATASETS_DIR', 'datasets')
+
+# universities whose canonical identity is set by hand, see university_index.py
+university_overrides_path = os.path.join(datasets_dir, 'university_overrides.csv')
+
+# every ranking is read from datasets/<name>.csv and datasets/<name>-<year>.csv, and refreshed every
+# DATASETS_WATCH_SECONDS seconds by parsing only the new rows (0 disables the refresh)
+datasets_watch_seconds = float(os.environ.get('DATASETS_WATCH_SECONDS', 30))
+ingest = RankingIngest(datasets_dir, ranking_sources)
+
+times_df, shanghai_df, cwur_df = ingest.load()
+
+# criteria of the rankings, the criteria of every year are derived from the data (see RankingStore.year_columns)
 times_complete_columns = ['Teaching', 'International', 'Research', 'Citations', 'Income']
-times_year_columns = {'{}'.format(i): times_complete_columns for i in range(2011, 2024)}
-
-shanghai_df = pd.read_csv('datasets/shanghai.csv', encoding='cp1252')
 shanghai_complete_columns = ['Alumni', 'Award', 'HiCi', 'N&S', 'PUB', 'PCP']
-shanghai_year_columns = {'{}'.format(i): shanghai_complete_columns for i in range(2012, 2023)}
-
-cwur_df = pd.read_csv('datasets/cwur.csv')
 cwur_complete_columns = ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Publications', 'Influence', 'Citations', 'Broad Impact', 'Patents', 'Research Output', 'Research Performance']
-cwur_year_columns = {
-    '2012': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Publications', 'Influence', 'Citations', 'Patents'],
-    '2013': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Publications', 'Influence', 'Citations', 'Patents'],
-    '2014': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Publications', 'Influence', 'Citations', 'Broad Impact', 'Patents'],
-    '2015': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Publications', 'Influence', 'Citations', 'Broad Impact', 'Patents'],
-    '2016': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Publications', 'Influence', 'Citations', 'Broad Impact', 'Patents'],
-    '2017': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Publications', 'Influence', 'Citations', 'Broad Impact', 'Patents'],
-    '2018': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Publications', 'Influence', 'Citations', 'Research Output'],
-    '2019': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Research Performance'],
-    '2020': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Research Performance'],
-    '2021': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Research Performance'],
-    '2022': ['Quality of Education', 'Alumni Employment', 'Quality of Faculty', 'Research Performance'],
-}
 
 
 class Rankings(enum.Enum):
@@ -47,64 +60,132 @@ rankings_names = ['Times Higher Education World Rankings',
                   'Academic Ranking of World Universities', 'Center for World University Rankings']
 rankings_complete_columns = [times_complete_columns,
                              shanghai_complete_columns, cwur_complete_columns]
-rankings_year_columns = [times_year_columns,
-                         shanghai_year_columns, cwur_year_columns]
 
-token = open("datasets/.mapbox_token").read()
-with open('datasets/countries.geojson') as f:
-    countries = geojson.load(f)
+# partitions, university indexes and country metrics of the rankings
+# store is swapped for a new snapshot when the rankings change, so every callback reads it once and hands
+# that snapshot to the builders, whose figures are cached per version of the ranking they show
+def load_store(rankings_df):
+    return RankingStore(rankings_df, rankings_complete_columns, load_university_index(rankings_df, ingest.paths(), university_overrides_path), ingest.versions)
 
-# Global Variables for the Selected Data
-# Main Dashboard
-current_main_rankings = Rankings.times
-current_main_university_list = pd.DataFrame()
-current_main_criterion = "Overall Score"
-current_main_year = 2022
+store = load_store(rankings_df)
 
-# University Overview Page
-current_university_rankings = Rankings.times
-current_university_name = "Harvard University"
-current_university_year = 2022
+# figures of the chart builders, bounded by FIGURE_CACHE_MAX_ENTRIES and optionally FIGURE_CACHE_MAX_BYTES
+figure_cache = FigureCache(
+    max_entries=int(os.environ.get('FIGURE_CACHE_MAX_ENTRIES', 256)),
+    max_bytes=int(os.environ['FIGURE_CACHE_MAX_BYTES']) if 'FIGURE_CACHE_MAX_BYTES' in os.environ else None,
+)
 
-activated_class = 'btn btn-primary mx-3'
-deactivated_class = 'btn btn-secondary mx-3'
+# latency, output size and trigger metrics of the callbacks and builders, served on /metrics
+# a PROFILE_SAMPLE_RATE share of the callbacks is profiled and dumped to PROFILE_DIR when slower than PROFILE_SLOW_SECONDS
+metrics = Metrics(SlowRequestProfiler(
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    slow_seconds=float(os.environ.get('PROFILE_SLOW_SECONDS', 0.5)),
+    directory=os.environ.get('PROFILE_DIR', os.path.join(dataset_cache.cache_dir, 'profiles')),
+), output_sample_rate=float(os.environ.get('OUTPUT_SIZE_SAMPLE_RATE', 0.05)))
+render_versions = RenderVersions()
+metrics.gauge('dashboard_stale_renders', 'Callback requests skipped or stopped because a newer request of the same page replaced them', lambda: render_versions.skipped)
+# compressed responses, with ETags and 304s for the GET ones, COMPRESSION_LEVEL=0 leaves the compression to a proxy
+http_cache = HttpCache(level=int(os.environ.get('COMPRESSION_LEVEL', 6)))
+metrics.gauge('dashboard_http_unchanged_figures', 'Figure callbacks answered with no update because the page already had their response', lambda: http_cache.stats()['unchanged'])
+metrics.gauge('dashboard_http_not_modified', 'GET requests answered with 304 Not Modified', lambda: http_cache.stats()['not_modified'])
+metrics.gauge('dashboard_http_body_bytes', 'Bytes of the response bodies before compression', lambda: http_cache.stats()['body_bytes'])
+metrics.gauge('dashboard_http_wire_bytes', 'Bytes of the response bodies as sent', lambda: http_cache.stats()['wire_bytes'])
+metrics.gauge('dashboard_figure_cache_entries', 'Figures in the figure cache', lambda: figure_cache.stats()['entries'])
+metrics.gauge('dashboard_figure_cache_hits', 'Figure cache hits', lambda: figure_cache.stats()['hits'])
+metrics.gauge('dashboard_figure_cache_misses', 'Figure cache misses', lambda: figure_cache.stats()['misses'])
+metrics.gauge('dashboard_figure_cache_evictions', 'Figures evicted from the figure cache', lambda: figure_cache.stats()['evictions'])
+metrics.gauge('dashboard_process_private_bytes', 'Memory of this worker that is not shared with the other processes', lambda: (process_memory() or {}).get('private', 0))
+metrics.gauge('dashboard_process_shared_bytes', 'Memory of this worker that is shared copy-on-write with the other processes', lambda: (process_memory() or {}).get('shared', 0))
+metrics.gauge('dashboard_store_bytes', 'Memory of the rankings held by the store', lambda: store_bytes(store))
+
+
+# Swaps in a snapshot with the new rows of the changed rankings, called by the ingest thread
+# the store only builds the structures of the changed rankings, and of those whose university IDs changed, and
+# the university index is only matched again when a changed ranking has names it does not know
+# the figures of the rankings that were built again are dropped from the figure cache, those of the others stay
+def refresh_datasets(changed=None):
+    global times_df, shanghai_df, cwur_df, rankings_df, store
+    new_rankings_df = ingest.dataframes()
+    changed = range(len(new_rankings_df)) if changed is None else changed
+    university_ids = store.university_ids
+    if any(not set(new_rankings_df[ranking]['University'].dropna().unique()).issubset(university_ids[ranking]) for ranking in changed):
+        university_ids = load_university_index(new_rankings_df, ingest.paths(), university_overrides_path)
+    new_store = RankingStore(new_rankings_df, rankings_complete_columns, university_ids, ingest.versions, previous=store)
+    times_df, shanghai_df, cwur_df = rankings_df = new_rankings_df
+    load_countries_asset()
+    # a ranking whose university IDs changed is built again under the same version
+    rebuilt_versions = {store.versions[ranking] for ranking in range(len(new_rankings_df)) if new_store.partitions[ranking] is not store.partitions[ranking]}
+    store = new_store
+    figure_cache.invalidate(versions=rebuilt_versions)
+
+token = open(os.path.join(datasets_dir, '.mapbox_token')).read()
+
+# simplified geometry of the countries in the rankings, served once as a static asset
+# so the map figures only carry the country names and counts
+def load_countries_asset():
+    return build_countries_asset(pd.concat([df['Country'] for df in rankings_df]).dropna().unique(), source=os.path.join(datasets_dir, 'countries.geojson'))
+
+countries = '/' + load_countries_asset()
+
+# Default Selections
+# The selections of every user are kept in the dcc.Store components of their session, not on the server
+# Main Dashboard
+default_main_rankings = Rankings.times
+default_main_criterion = "Overall Score"
+default_main_year = max(store.years(default_main_rankings.value))
 
-# Main Dashboard Buttons
-btn_main_times_class = activated_class
-btn_main_shanghai_class = deactivated_class
-btn_main_cwur_class = deactivated_class
+# University Overview Page
+default_university_rankings = Rankings.times
+default_university_name = "Harvard University"
+default_university_year = max(store.years(default_university_rankings.value))
 
-# University Overview Buttons
-btn_univ_times_class = activated_class
-btn_univ_shanghai_class = deactivated_class
-btn_univ_cwur_class = deactivated_class
+# marks of the year sliders, one per year of the rankings
+def load_year_marks(store):
+    first_year, last_year = store.year_range()
+    return {i: '{}'.format(i) for i in range(first_year, last_year + 1)}
 
 # Main Dashboard
 
 # Chloropleth Map
-def load_choropleth_map(university_rankings, main_year):
-    current_df = rankings_df[university_rankings.value]
-    current_df = current_df[current_df['Year'] == main_year]
-    country_df = current_df[['Country', 'University']].groupby(['Country'], as_index = False).count()
+# metrics of the countries that can be shown on the map for a ranking and year
+@metrics.builder('map-metrics')
+def load_map_metrics(store, university_rankings, main_year):
+    return country_base_metrics + ['Mean {}'.format(criterion) for criterion in store.year_columns(university_rankings.value, main_year)]
+
+@figure_cache.memoize('choropleth', lambda store, university_rankings, main_year, metric: (store.versions[university_rankings.value], university_rankings.value, int(main_year), metric))
+@render_versions.checkpoint
+@metrics.builder('choropleth')
+def load_choropleth_map(store, university_rankings, main_year, metric):
+    country_df = store.country_metrics(university_rankings.value, main_year)
+    country_df = country_df[country_df[metric].notna()] if metric in country_df else country_df.iloc[0:0].assign(**{metric: []})
     choropleth_fig = px.choropleth_mapbox(country_df,
                                     geojson = countries,
                                     featureidkey = 'properties.name_en',
                                     locations = 'Country',
-                                    color = 'University',
+                                    color = metric,
                                     zoom = 0.2,
                                     color_continuous_scale = px.colors.sequential.Blues
                                     )
     choropleth_fig.update_layout(height=300, margin={"r":0,"t":0,"l":0,"b":0}, mapbox_accesstoken = token)
+    # a lower rank is better, so it gets the darker color
+    choropleth_fig.update_coloraxes(reversescale = metric == 'Best World Rank')
     
     return choropleth_fig
 
-choropleth_mapbox = load_choropleth_map(current_main_rankings, current_main_year)
+# placeholder figures, built once
+select_university_figure = FigureTemplate(go.Figure().add_annotation(text="Select a University from the Table", showarrow=False, font={"size": 20}).update_xaxes(visible=False).update_yaxes(visible=False).update_layout(width=800, height=600)).fill()
+no_earlier_year_figure = FigureTemplate(go.Figure().add_annotation(text="No Earlier Year to Compare With", showarrow=False, font={"size": 20}).update_xaxes(visible=False).update_yaxes(visible=False).update_layout(width=800, height=600)).fill()
+no_data_figure = FigureTemplate(go.Figure().add_annotation(text="No Data", showarrow=False, font={"size": 20}).update_xaxes(visible=False).update_yaxes(visible=False).update_layout(height=300, width=1200)).fill()
 
 # Bar Chart (Criteria Comparision)
-def load_main_bar_chart(university_list, university_rankings, main_year):
+@figure_cache.memoize('main-bar', lambda store, university_names, university_rankings, main_year: (store.versions[university_rankings.value], tuple(sorted(university_names)), university_rankings.value, int(main_year)))
+@render_versions.checkpoint
+@metrics.builder('main-bar')
+def load_main_bar_chart(store, university_names, university_rankings, main_year):
+    university_list = store.universities(university_rankings.value, main_year, university_names)
     if not university_list.empty:
         criteria = ["University"] + rankings_complete_columns[university_rankings.value]
-        current_df = university_list[criteria]
+        current_df = display_frame(university_list[criteria])
         fig = px.bar(current_df, x=criteria, y="University", barmode='group', labels=criteria)
         fig.update_layout(width=800, height=600)
         fig.update_layout(yaxis=dict(autorange="reversed"))
@@ -117,158 +198,265 @@ def load_main_bar_chart(university_list, university_rankings, main_year):
         )
         return fig
     else:
-        fig = go.Figure().add_annotation(text="Select a University from the Table", showarrow=False, font={"size": 20}).update_xaxes(visible=False).update_yaxes(visible=False)
-        fig.update_layout(width=800, height=600)
-        return fig
-
-main_trend_fig = load_main_bar_chart(current_main_university_list, current_main_rankings, current_main_year)
+        return select_university_figure
 
 # Line Chart(Trend)
-def load_main_line_chart(university_list, university_rankings, criterion):
+# up to TREND_MAX_UNIVERSITIES universities are drawn as WebGL lines on shared axes, a larger selection as the
+# median and interquartile band of the selection per year
+trend_max_universities = int(os.environ.get('TREND_MAX_UNIVERSITIES', 25))
+
+# y values (Trend) and hover labels (Trend Label) of a criterion, World Rank holds labels such as "201-250"
+# so its order is drawn instead
+def load_trend_values(history_df, criterion):
+    history_df = display_frame(history_df)
+    if criterion == 'World Rank':
+        return history_df.assign(**{'Trend': history_df['World Rank Order'], 'Trend Label': history_df['World Rank']})
+    return history_df.assign(**{'Trend': history_df[criterion], 'Trend Label': history_df[criterion]})
+
+def load_trend_title(criterion, university_rankings, university_count):
+    title = "<b>{}</b> Trend in the <b>{}</b>".format(criterion, rankings_names[university_rankings.value])
+    if university_count > trend_max_universities:
+        title += "<br>Median and interquartile range of <b>{}</b> universities".format(university_count)
+    return title
+
+@figure_cache.memoize('main-line', lambda store, university_names, university_rankings, main_year, criterion: (store.versions[university_rankings.value], tuple(sorted(university_names)), university_rankings.value, int(main_year), criterion))
+@render_versions.checkpoint
+@metrics.builder('main-line')
+def load_main_line_chart(store, university_names, university_rankings, main_year, criterion):
+    university_list = store.universities(university_rankings.value, main_year, university_names)
     if not university_list.empty:
-        fig = make_subplots(rows=len(university_list), cols=1, subplot_titles=university_list["University"].values.tolist())
-
-        for index, university_name in enumerate(university_list["University"]):
-            current_df = rankings_df[university_rankings.value]
-            university_df = current_df[(current_df["University"] == university_name)].sort_values(by=["Year"], ascending=True)
-            year_list = university_df["Year"].values.tolist()
-            criteria_list = university_df[criterion].values.tolist()
+        history_df = load_trend_values(store.histories(university_rankings.value, university_list["University"].tolist()), criterion)
+        fig = go.Figure()
 
-            color_index = (['World Rank', 'Overall Score'] + rankings_year_columns[current_main_rankings.value][str(current_main_year)]).index(criterion) - 2
+        if len(university_list) <= trend_max_universities:
+            for index, (university_name, university_df) in enumerate(history_df.groupby('Selection', sort=False)):
+                fig.add_trace(
+                    go.Scattergl(
+                        x=university_df["Year"].values.tolist(), y=university_df["Trend"].values.tolist(), name=university_name, mode='markers+lines',
+                        line=dict(color=px.colors.qualitative.Plotly[index % 10]),
+                        meta=[university_name, criterion],
+                        customdata=university_df["Trend Label"].values.tolist(),
+                        hovertemplate="<b>%{meta[0]}</b><br><b>Year</b>: %{x}<br><b>%{meta[1]}</b>: %{customdata}<extra></extra>"
+                    )
+                )
+        else:
+            band_df = history_df.groupby("Year")["Trend"].quantile([0.25, 0.5, 0.75]).unstack()
+            years = band_df.index.tolist()
+            fig.add_trace(go.Scattergl(x=years, y=band_df[0.75].tolist(), mode='lines', line=dict(width=0), hoverinfo='skip', showlegend=False))
             fig.add_trace(
-                go.Scatter(
-                    x=year_list, y=criteria_list, name=university_name, mode='markers+lines',
-                    line=dict(color=px.colors.qualitative.Plotly[color_index]),
-                    meta=[university_name, criterion],
-                    hovertemplate="<b>%{meta[0]}</b><br><b>Year</b>: %{x}<br><b>%{meta[1]}</b>: %{y}<extra></extra>"
-                ),
-                row=index+1,
-                col=1
+                go.Scattergl(
+                    x=years, y=band_df[0.25].tolist(), name='Interquartile range', mode='lines', line=dict(width=0),
+                    fill='tonexty', fillcolor='rgba(99, 110, 250, 0.2)', hoverinfo='skip'
+                )
+            )
+            fig.add_trace(
+                go.Scattergl(
+                    x=years, y=band_df[0.5].tolist(), name='Median', mode='markers+lines',
+                    line=dict(color=px.colors.qualitative.Plotly[0]),
+                    meta=criterion,
+                    customdata=history_df.groupby("Year")["Selection"].nunique().tolist(),
+                    hovertemplate="<b>Year</b>: %{x}<br><b>Median %{meta}</b>: %{y}<br><b>Universities</b>: %{customdata}<extra></extra>"
+                )
             )
 
-        fig.update_layout(showlegend=False)
         fig.update_layout(width=800, height=600)
+        fig.update_layout(dict(template="plotly_white"))
         fig.update_layout(
-            title_text="<b>{}</b> Trend in the <b>{}</b>".format(criterion, rankings_names[university_rankings.value]),
+            title_text=load_trend_title(criterion, university_rankings, len(university_list)),
             title_x=0.5,
+            xaxis_title="Year",
+            yaxis_title=criterion,
         )
-        
+        fig.update_yaxes(autorange="reversed" if criterion == 'World Rank' else True)
+
         return fig
     else:
-        fig = go.Figure().add_annotation(text="Select a University from the Table", showarrow=False, font={"size": 20}).update_xaxes(visible=False).update_yaxes(visible=False)
-        fig.update_layout(width=800, height=600)
-        return fig
-
-
-main_line_fig = load_main_line_chart(current_main_university_list, current_main_rankings, current_main_criterion)
+        return select_university_figure
 
 # University Page
 # Line Charts
-def load_university_line_chart(university_rankings, university_name):
-    current_df = rankings_df[university_rankings.value]
+# skeleton of the line charts of a ranking, one subplot and trace per criterion, see figure_templates.py
+@functools.lru_cache(maxsize=None)
+def load_university_line_template(university_rankings):
     criteria = ["World Rank", "Overall Score"] + rankings_complete_columns[university_rankings.value]
     fig = make_subplots(rows=math.ceil(len(criteria) / 4), cols=4, subplot_titles=criteria)
-    current_df_conditions = (current_df["University"] == university_name)
-    current_df = current_df[current_df_conditions].sort_values(by=["Year"], ascending=True)
-    if not current_df.empty:
-        for index, criterion in enumerate(criteria):
-            year_list = current_df["Year"].values.tolist()
+    for index, criterion in enumerate(criteria):
+        fig.add_trace(
+            go.Scatter(
+                x=[], y=[], name=criterion, mode='markers+lines',
+                meta=criterion,
+                marker=dict(color=px.colors.qualitative.Plotly[(index-2) % 10]),
+                # World Rank is drawn by its order, its labels such as "201-250" are in the hover
+                hovertemplate="<b>Year</b>: %{x}<br><b>%{meta}</b>: %{customdata}<extra></extra>" if criterion == "World Rank" else "<b>Year</b>: %{x}<br><b>%{meta}</b>: %{y}<extra></extra>"
+            ),
+            row=index // 4 + 1,
+            col=index % 4 + 1
+        )
+
+    fig.update_yaxes(autorange="reversed", row=1, col=1)
+    fig.update_layout(height=300, width=1200)
+    fig.update_layout(title_text="", title_x=0.5)
+    fig.update_layout(showlegend=False)
+    return FigureTemplate(fig)
 
+@figure_cache.memoize('university-line', lambda store, university_rankings, university_name: (store.versions[university_rankings.value], university_rankings.value, university_name))
+@render_versions.checkpoint
+@metrics.builder('university-line')
+def load_university_line_chart(store, university_rankings, university_name):
+    criteria = ["World Rank", "Overall Score"] + rankings_complete_columns[university_rankings.value]
+    current_df = display_frame(store.history(university_rankings.value, university_name))
+    if not current_df.empty:
+        year_list = current_df["Year"].values.tolist()
+        traces = []
+        for criterion in criteria:
             if criterion == "World Rank":
-                criteria_list = current_df["World Rank Order"].values.tolist()
-                fig.add_trace(
-                    go.Scatter(
-                        x=year_list, y=criteria_list, name=criterion, mode='markers+lines',
-                        meta=criterion,
-                        customdata=current_df["World Rank"].values.tolist(),
-                        marker=dict(color=px.colors.qualitative.Plotly[(index-2) % 10]),
-                        hovertemplate="<b>Year</b>: %{x}<br><b>%{meta}</b>: %{customdata}<extra></extra>"
-                    ),
-                    row=index // 4 + 1,
-                    col=index % 4 + 1
-                )
+                traces.append({'x': year_list, 'y': current_df["World Rank Order"].values.tolist(), 'customdata': current_df["World Rank"].values.tolist()})
             else:
-                criteria_list = current_df[criterion].values.tolist()
-                fig.add_trace(
-                    go.Scatter(
-                        x=year_list, y=criteria_list, name=criterion, mode='markers+lines',
-                        meta=criterion,
-                        marker=dict(color=px.colors.qualitative.Plotly[(index-2) % 10]),
-                        hovertemplate="<b>Year</b>: %{x}<br><b>%{meta}</b>: %{y}<extra></extra>"
-                    ),
-                    row=index // 4 + 1,
-                    col=index % 4 + 1
-                )
+                traces.append({'x': year_list, 'y': current_df[criterion].values.tolist()})
 
-        fig.update_yaxes(autorange="reversed", row=1, col=1)
-        fig.update_layout(height=300, width=1200)
-        fig.update_layout(
-            title_text="Historical Performance of <b>{}</b> in the <b>{}</b>".format(university_name, rankings_names[university_rankings.value]),
-            title_x=0.5,
-        )
-        fig.update_layout(showlegend=False)
-        return fig
+        return load_university_line_template(university_rankings).fill(traces, {
+            'title': {'text': "Historical Performance of <b>{}</b> in the <b>{}</b>".format(university_name, rankings_names[university_rankings.value])},
+        })
     else:
-        fig = go.Figure().add_annotation(text="No Data", showarrow=False, font={"size": 20}).update_xaxes(visible=False).update_yaxes(visible=False)
-        fig.update_layout(height=300, width=1200)
-        return fig
+        return no_data_figure
 
+# Radar Charts
+# skeleton of the radar charts of the rankings a university is listed in, one polar subplot per ranking
+@functools.lru_cache(maxsize=None)
+def load_university_radar_template(rankings_values):
+    fig = make_subplots(
+        rows=1,
+        cols=len(rankings_values),
+        specs=[[{"type": "polar"}] * len(rankings_values)],
+        subplot_titles=[rankings_names[rankings_value] for rankings_value in rankings_values]
+    )
+    for index, rankings_value in enumerate(rankings_values):
+        fig.add_trace(
+            go.Scatterpolar(
+                r=[],
+                theta=[],
+                name=rankings_names[rankings_value],
+                hovertemplate="<b>%{theta}</b>: %{r}<extra></extra>",
+                marker=dict(color=px.colors.qualitative.Plotly[0]),
+                fill='toself'
+            ),
+            row=1,
+            col=index+1
+        )
 
-university_trend_fig = load_university_line_chart(current_university_rankings, current_university_name)
+    fig.update_annotations(yshift=20)
+    fig.update_annotations(font_size=14)
+    fig.update_layout(polar=dict(radialaxis=dict(visible=False, range=[0, 100])))
+    fig.update_layout(showlegend=False)
+    fig.update_layout(height=300, width=1200)
+    return FigureTemplate(fig)
 
-# Radar Charts
-def load_university_radar_chart(university_name, university_year):
+@figure_cache.memoize('university-radar', lambda store, university_name, university_year: (store.versions, university_name, int(university_year)))
+@render_versions.checkpoint
+@metrics.builder('university-radar')
+def load_university_radar_chart(store, university_name, university_year):
 
-    radar_fig_list = []
-    radar_names_list = []
+    rankings_values = []
+    traces = []
     for university_rankings in Rankings:
-        current_df = rankings_df[university_rankings.value]
-        current_university = current_df[(current_df["University"] == university_name) & (current_df["Year"] == university_year)].squeeze()
-        current_year_columns = rankings_year_columns[university_rankings.value][str(university_year)]
-        current_year_columns = current_year_columns + [current_year_columns[0]]
-        current_university.name = rankings_names[university_rankings.value]
+        current_university = store.university_year(university_rankings.value, university_name, university_year)
         if not current_university.empty:
-            radar_fig_list.append(
-                go.Scatterpolar(
-                    r=current_university[current_year_columns],
-                    theta=current_year_columns,
-                    name=rankings_names[university_rankings.value],
-                    hovertemplate="<b>%{theta}</b>: %{r}<extra></extra>",
-                    marker=dict(color=px.colors.qualitative.Plotly[0]),
-                    fill='toself'
-                )
-            )
-            radar_names_list.append(rankings_names[university_rankings.value])
-
-    if len(radar_fig_list) > 0:
-        fig = make_subplots(
-            rows=1, 
-            cols=len(radar_fig_list), 
-            specs=[[{"type": "polar"}] * len(radar_fig_list)], 
-            subplot_titles=["{} {}".format(university_year, university_rankings) for university_rankings in radar_names_list]
-        )
-        for index, radar in enumerate(radar_fig_list):
-            fig.add_trace(
-                radar,
-                row=1,
-                col=index+1
-            )
-            
-        fig.update_annotations(yshift=20)
-        fig.update_annotations(font_size=14)
-        fig.update_layout(polar=dict(radialaxis=dict(visible=False, range=[0, 100])))
-        fig.update_layout(showlegend=False)
-        fig.update_layout(height=300, width=1200)
-        return fig
+            current_year_columns = store.year_columns(university_rankings.value, university_year)
+            # only the criteria of the row are converted to plain dtypes
+            current_university = display_frame(current_university[current_year_columns]).iloc[0]
+            current_year_columns = current_year_columns + [current_year_columns[0]]
+            traces.append({'r': current_university[current_year_columns].tolist(), 'theta': current_year_columns})
+            rankings_values.append(university_rankings.value)
+
+    if len(traces) > 0:
+        template = load_university_radar_template(tuple(rankings_values))
+        return template.fill(traces, {
+            'annotations': template.annotations(["{} {}".format(university_year, rankings_names[rankings_value]) for rankings_value in rankings_values]),
+        })
     else:
-        fig = go.Figure().add_annotation(text="No Data", showarrow=False, font={"size": 20}).update_xaxes(visible=False).update_yaxes(visible=False)
-        fig.update_layout(height=300, width=1200)
-        return fig
+        return no_data_figure
+
+# Similar Universities
+# the universities of the ranking and year of the overview whose criteria are closest to the university's, see similarity.py
+similar_count = 10
+
+@render_versions.checkpoint
+@metrics.builder('similar-universities')
+def load_similar_universities(store, university_rankings, university_name, university_year):
+    similar_df = display_frame(store.similar_universities(university_rankings.value, university_name, university_year, similar_count)[['World Rank', 'University', 'Country', 'Distance']])
+    return similar_df.assign(Distance=similar_df['Distance'].round(2)).to_dict('records')
+
+# Movers
+# the universities that rose or fell the most in a ranking between two years, see movers.py
+movers_count = 10
+
+# criteria a ranking published in both years
+def load_movers_criteria(store, university_rankings, from_year, to_year):
+    from_columns = store.year_columns(university_rankings.value, from_year)
+    return ['Overall Score'] + [criterion for criterion in store.year_columns(university_rankings.value, to_year) if criterion in from_columns]
+
+def format_movers_value(value, metric):
+    return '-' if pd.isna(value) else '{:.1f}'.format(value) if metric != 'World Rank' else '{}'.format(value)
+
+@figure_cache.memoize('movers', lambda store, university_rankings, from_year, to_year, metric, country: (store.versions[university_rankings.value], university_rankings.value, int(from_year), int(to_year), metric, country))
+@render_versions.checkpoint
+@metrics.builder('movers')
+def load_movers_chart(store, university_rankings, from_year, to_year, metric, country):
+    movers_df = align_years(
+        store.partition(university_rankings.value, from_year),
+        store.partition(university_rankings.value, to_year),
+        store.partition_codes(university_rankings.value, from_year),
+        store.partition_codes(university_rankings.value, to_year),
+        # only the criterion of the chart is aligned, the rank metrics always are
+        [criterion for criterion in load_movers_criteria(store, university_rankings, from_year, to_year) if criterion == metric],
+    )
+    risers_df, fallers_df = top_movers(movers_df, metric, movers_count, country)
+    value_columns = ['World Rank Label From', 'World Rank Label To'] if metric == 'World Rank' else ['{} From'.format(metric), '{} To'.format(metric)]
+
+    fig = make_subplots(rows=2, cols=1, subplot_titles=['Top Risers', 'Top Fallers'], vertical_spacing=0.12)
+    for row, (current_df, color) in enumerate([(risers_df, px.colors.qualitative.Plotly[2]), (fallers_df, px.colors.qualitative.Plotly[1])]):
+        fig.add_trace(
+            go.Bar(
+                x=current_df[metric].values.tolist(), y=current_df["University"].values.tolist(), orientation='h',
+                marker=dict(color=color),
+                meta=metric,
+                customdata=[[format_movers_value(value_from, metric), format_movers_value(value_to, metric), country_name] for value_from, value_to, country_name in zip(current_df[value_columns[0]], current_df[value_columns[1]], current_df["Country"])],
+                hovertemplate="<b>%{y}</b> (%{customdata[2]})<br><b>%{meta}</b>: %{customdata[0]} → %{customdata[1]}<br><b>Change</b>: %{x:+.1f}<extra></extra>"
+            ),
+            row=row+1,
+            col=1
+        )
+
+    fig.update_yaxes(autorange="reversed")
+    fig.update_layout(showlegend=False)
+    fig.update_layout(width=800, height=600)
+    fig.update_layout(dict(template="plotly_white"))
+    fig.update_layout(
+        title_text="<b>{}</b> Movers from {} to {} in the <b>{}</b>{}".format(metric, from_year, to_year, rankings_names[university_rankings.value], ', {}'.format(country) if country else ''),
+        title_x=0.5,
+    )
+    return fig
+
+# Table
+# World Rank holds labels such as "=2" or "201-250", so it is ordered by its numeric order instead
+table_sort_columns = {'World Rank': 'World Rank Order'}
+
+@render_versions.checkpoint
+@metrics.builder('table-page')
+def load_table_page(store, university_rankings, main_year, criterion, filter_query, sort_by, page_current, page_size):
+    current_df = store.partition(university_rankings.value, main_year)
+    current_df = filter_table(current_df, filter_query)
+    current_df = sort_table(current_df, sort_by, table_sort_columns)
+    page_df, page_current, page_count = page_table(current_df, page_current, page_size)
 
-radar_fig = load_university_radar_chart(current_university_name, current_university_year)
+    # only the displayed columns of the visible rows are sent to the browser
+    page_df = display_frame(page_df[list(dict.fromkeys([criterion, "University", 'Country']))])
+    data = page_df.assign(**{'': 'ⓘ', 'id': page_df.index}).to_dict('records')
+    return data, page_current, page_count
 
 # initialize application
 app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+server = app.server
 
 university_table = dash_table.DataTable(
     style_data={
@@ -276,20 +464,25 @@ university_table = dash_table.DataTable(
         'height': 'auto',
     },
     id='university-table',
-    data=rankings_df[current_main_rankings.value][rankings_df[current_main_rankings.value]['Year'] == current_main_year].reset_index(drop=True).to_dict('records'),
-    columns=[{"name": name, "id": name} for name in [current_main_criterion, "University", 'Country', '']],
-    sort_action='native',
-    filter_action='native',
+    data=[],
+    columns=[{"name": name, "id": name} for name in [default_main_criterion, "University", 'Country', '']],
+    sort_action='custom',
+    sort_by=[],
+    filter_action='custom',
+    filter_query='',
     filter_options={"case": "insensitive"},
     row_selectable='multi',
+    page_action='custom',
+    page_current=0,
     page_size=5,
+    page_count=1,
     style_cell_conditional=[
         {
             'if': {'column_id': ''},
             'width': '10px',
         },
         {
-            'if': {'column_id': current_main_criterion},
+            'if': {'column_id': default_main_criterion},
             'width': '20px',
         },
     ],
@@ -299,6 +492,13 @@ university_table = dash_table.DataTable(
 main = html.Div([
     # html.H1('University Rankings Dashboard'),
 
+    dcc.Store(id='main-rankings', data=default_main_rankings.value),
+    dcc.Store(id='main-selection', data=[]),
+    dcc.Store(id='choropleth-rendered', data=False),
+    # versions of the rankings the sliders were built for, compared to the server ones every DATASETS_WATCH_SECONDS
+    dcc.Store(id='data-version', data=list(store.versions)),
+    dcc.Interval(id='data-version-interval', interval=max(datasets_watch_seconds, 1) * 1000, disabled=datasets_watch_seconds <= 0),
+
     html.Div([
         html.Button('Times Higher Education Rankings',
                     id='btn-times-main', className='btn btn-secondary mx-3'),
@@ -310,11 +510,11 @@ main = html.Div([
 
     html.Div([
         dcc.Slider(
-            min=2012,
-            max=2022,
+            min=store.year_range()[0],
+            max=store.year_range()[1],
             step=1,
-            value=2022,
-            marks={i: '{}'.format(i) for i in range(2012, 2023)},
+            value=default_main_year,
+            marks=load_year_marks(store),
             id='main-slider'
         ),
     ]),
@@ -333,6 +533,26 @@ main = html.Div([
                             dcc.Graph(id='main-bar-chart'),
                         ]
                     ),
+                    dcc.Tab(
+                        label='Movers', value='movers-tab',
+                        children=[
+                            html.Div([
+                                html.Div([
+                                    html.Span("From:"),
+                                    dcc.Dropdown(id='movers-from-year', clearable=False),
+                                ], className="col-3"),
+                                html.Div([
+                                    html.Span("Metric:"),
+                                    dcc.Dropdown(id='movers-metric', value='World Rank', clearable=False),
+                                ], className="col-4"),
+                                html.Div([
+                                    html.Span("Country:"),
+                                    dcc.Dropdown(id='movers-country', placeholder='All Countries'),
+                                ], className="col-5"),
+                            ], className="row pt-3"),
+                            dcc.Graph(id='movers-chart'),
+                        ]
+                    ),
                 ]),
             ], 
             id="tab-container", 
@@ -341,14 +561,29 @@ main = html.Div([
 
         html.Div(
            children= [
-                dcc.Graph(id='choropleth_map', figure = choropleth_mapbox, config={'displayModeBar': False}, animate = False),
+                html.Div([
+                    html.Div(children=[html.Span("Map:")], className="col-2"),
+                    html.Div(
+                        children = [
+                            dcc.Dropdown(
+                                load_map_metrics(store, default_main_rankings, default_main_year),
+                                country_base_metrics[0],
+                                placeholder='Select a Metric',
+                                clearable=False,
+                                id='map-metric-dropdown',
+                            ),
+                        ],
+                        className="col-10"
+                    ),
+                ], className="row align-items-center"),
+                dcc.Graph(id='choropleth_map', config={'displayModeBar': False}, animate = False),
                 html.Div([
                     html.Div(children=[html.Span("Criteria:")], className="col-2"),
                     html.Div(
                         children = [
                             dcc.Dropdown(
-                                ['World Rank', 'Overall Score'] + rankings_year_columns[current_main_rankings.value][str(current_main_year)],
-                                (['World Rank', 'Overall Score'] + rankings_year_columns[current_main_rankings.value][str(current_main_year)])[0],
+                                ['World Rank', 'Overall Score'] + store.year_columns(default_main_rankings.value, default_main_year),
+                                'World Rank',
                                 placeholder='Select a Criteria',
                                 clearable=False,
                                 id='criteria-dropdown',
@@ -367,6 +602,9 @@ main = html.Div([
 # HTML for University Page
 modal_body = html.Div([
 
+    dcc.Store(id='university-rankings', data=default_university_rankings.value),
+    dcc.Store(id='university-name', data=default_university_name),
+
     html.H5('Main Dashboard', id='university-name-title'),
 
     html.Div([
@@ -382,24 +620,38 @@ modal_body = html.Div([
     ], className='d-flex justify-content-center'),
 
     html.Div([
-        html.Div([dcc.Graph(id='university-line-chart', figure=university_trend_fig)], className='col-12'),
+        html.Div([dcc.Graph(id='university-line-chart')], className='col-12'),
     ], className='row'),
 
     html.Div([
         html.Hr(),
         dcc.Slider(
-            min=2012,
-            max=2022,
+            min=store.year_range()[0],
+            max=store.year_range()[1],
             step=1,
-            value=2022,
-            marks={i: '{}'.format(i) for i in range(2012, 2023)},
+            value=default_university_year,
+            marks=load_year_marks(store),
             id='university-year-slider'
         ),
     ]),
 
     html.Div([
-        html.Div([dcc.Graph(id='university-radar-chart', figure=radar_fig)], className='col-12'),
+        html.Div([dcc.Graph(id='university-radar-chart')], className='col-12'),
     ], className='row'),
+
+    html.Div([
+        html.Hr(),
+        html.H5('Similar Universities', id='similar-title'),
+        dash_table.DataTable(
+            style_data={
+                'whiteSpace': 'normal',
+                'height': 'auto',
+            },
+            id='similar-table',
+            data=[],
+            columns=[{"name": name, "id": name} for name in ['World Rank', 'University', 'Country', 'Distance']],
+        ),
+    ], className='pb-3'),
 ], className='container')
 
 app.layout = dbc.Container([
@@ -418,196 +670,392 @@ app.layout = dbc.Container([
 ])
 
 # Callback for Main Dashboard
-# Tables
-
+# Every output is only recomputed when the inputs it depends on change
+# The logic that does not need the datasets runs in the browser, see assets/dashboard.js
 
-@ app.callback(
-    Output(component_id="criteria-dropdown", component_property="options"),
-    Output(component_id="main-bar-chart", component_property="figure"),
-    Output(component_id="main-line-chart", component_property="figure"),
-    Output(component_id="choropleth_map", component_property="figure"),
-    Output(component_id="university-table", component_property="data"),
-    Output(component_id="university-table", component_property="columns"),
-    Output(component_id='university-table', component_property="selected_rows"),
-    Output(component_id="university-table", component_property="filter_query"),
-    Output(component_id="university-table", component_property="style_cell_conditional"),
-    Output(component_id="choropleth_map", component_property="clickData"),
+# Buttons
+app.clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='selectRankings'),
+    Output(component_id="main-rankings", component_property="data"),
     Output(component_id="btn-times-main", component_property="className"),
     Output(component_id="btn-shanghai-main", component_property="className"),
     Output(component_id="btn-cwur-main", component_property="className"),
     Input(component_id="btn-times-main", component_property="n_clicks"),
     Input(component_id="btn-shanghai-main", component_property="n_clicks"),
     Input(component_id="btn-cwur-main", component_property="n_clicks"),
+)
+
+# Dropdown
+@ app.callback(
+    Output(component_id="criteria-dropdown", component_property="options"),
+    Output(component_id="criteria-dropdown", component_property="value"),
+    Input(component_id="main-rankings", component_property="data"),
     Input(component_id="main-slider", component_property="value"),
-    Input(component_id="criteria-dropdown", component_property="value"),
-    Input(component_id='university-table', component_property="derived_virtual_data"),
-    Input(component_id='university-table', component_property="derived_virtual_selected_rows"),
-    Input(component_id="university-table", component_property="filter_query"),
-    Input(component_id="tab-graphs", component_property="value"),
-    Input(component_id="choropleth_map", component_property="clickData")
+    State(component_id="criteria-dropdown", component_property="value"),
 )
-def update_main_dashboard(btn_times, btn_shanghai, btn_cwur, slider_value, dropdown_value, rows, selected_rows, filter_query, tab_value, selected_map):
-    # Slider and Dropdown Data
-    global current_main_year
-    global current_main_criterion
-    global current_main_rankings
-    global current_main_university_list
-    global btn_main_times_class
-    global btn_main_shanghai_class
-    global btn_main_cwur_class
-
-
-    current_main_year = slider_value
-    current_main_criterion = dropdown_value
-
-    # Buttons Data
-    button_rankings = Rankings.times
-    if "btn-times-main" == ctx.triggered_id:
-        current_main_rankings = Rankings.times
-        btn_main_times_class = activated_class
-        btn_main_shanghai_class = deactivated_class
-        btn_main_cwur_class = deactivated_class
-    elif "btn-shanghai-main" == ctx.triggered_id:
-        current_main_rankings = Rankings.shanghai
-        btn_main_times_class = deactivated_class
-        btn_main_shanghai_class = activated_class
-        btn_main_cwur_class = deactivated_class
-    elif "btn-cwur-main" == ctx.triggered_id:
-        current_main_rankings = Rankings.cwur
-        btn_main_times_class = deactivated_class
-        btn_main_shanghai_class = deactivated_class
-        btn_main_cwur_class = activated_class
- 
-    # Dropdown Data
-    options = ['World Rank', 'Overall Score'] + rankings_year_columns[current_main_rankings.value][str(current_main_year)]
-
-    if current_main_criterion not in options:
-        current_main_criterion = "World Rank"
-
-    # Tables Data
-    # load new df based on selected rankings and year
-    df = rankings_df[current_main_rankings.value][rankings_df[current_main_rankings.value]['Year'] == current_main_year].reset_index(drop=True)
-    df[''] = 'ⓘ'
-    data = df.to_dict('records')
-    columns=[{"name": name, "id": name} for name in [current_main_criterion, "University", 'Country', '']]
-
-    if filter_query is None:
-        filter_query = ''
+@ metrics.callback
+def update_criteria_dropdown(rankings_value, main_year, criterion):
+    options = ['World Rank', 'Overall Score'] + store.year_columns(rankings_value, main_year)
+    return options, criterion if criterion in options else "World Rank"
 
-    if selected_rows is None:
-        selected_rows = []
+@ app.callback(
+    Output(component_id="map-metric-dropdown", component_property="options"),
+    Output(component_id="map-metric-dropdown", component_property="value"),
+    Input(component_id="main-rankings", component_property="data"),
+    Input(component_id="main-slider", component_property="value"),
+    State(component_id="map-metric-dropdown", component_property="value"),
+)
+@ metrics.callback
+def update_map_metric_dropdown(rankings_value, main_year, metric):
+    options = load_map_metrics(store, Rankings(rankings_value), main_year)
+    return options, metric if metric in options else options[0]
 
-    # update the index of the currently selected universities
-    university_names = [] if rows is None else pd.DataFrame(rows)
-    university_names = university_names if len(university_names) == 0 else university_names.iloc[selected_rows]['University']  # currently selected universities
-    selected_index = df[df["University"].isin(university_names)].index.tolist()  # update the index
+# Chloropleth Map
+# the map only differs in its locations, values and color axis between views, so after the first render only those are sent
+@ app.callback(
+    Output(component_id="choropleth_map", component_property="figure"),
+    Output(component_id="choropleth-rendered", component_property="data"),
+    Input(component_id="main-rankings", component_property="data"),
+    Input(component_id="main-slider", component_property="value"),
+    Input(component_id="map-metric-dropdown", component_property="value"),
+    State(component_id="choropleth-rendered", component_property="data"),
+)
+@ metrics.callback
+def update_choropleth_map(rankings_value, main_year, metric, rendered):
+    choropleth_fig = load_choropleth_map(store, Rankings(rankings_value), main_year, metric)
+    if not rendered:
+        return choropleth_fig, True
+
+    patched_fig = Patch()
+    patched_fig['data'][0]['locations'] = choropleth_fig.data[0].locations
+    patched_fig['data'][0]['z'] = choropleth_fig.data[0].z
+    patched_fig['data'][0]['hovertemplate'] = choropleth_fig.data[0].hovertemplate
+    patched_fig['layout']['coloraxis'] = choropleth_fig.layout.coloraxis.to_plotly_json()
+    return patched_fig, no_update
+
+app.clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='filterMapCountry'),
+    Output(component_id="university-table", component_property="filter_query"),
+    Output(component_id="choropleth_map", component_property="clickData"),
+    Input(component_id="choropleth_map", component_property="clickData"),
+    State(component_id="university-table", component_property="filter_query"),
+    prevent_initial_call=True,
+)
 
-     # update the university list based on the new data and index
-    current_main_university_list = pd.DataFrame() if rows is None else pd.DataFrame(data).iloc[selected_index]
-    
-    choropleth_mapbox = load_choropleth_map(current_main_rankings, current_main_year)
-    
+# Tables
+@ app.callback(
+    Output(component_id="university-table", component_property="columns"),
+    Output(component_id="university-table", component_property="style_cell_conditional"),
+    Input(component_id="criteria-dropdown", component_property="value"),
+)
+@ metrics.callback
+def update_table_columns(criterion):
+    columns = [{"name": name, "id": name} for name in [criterion, "University", 'Country', '']]
     style_cell_conditional=[
         {
             'if': {'column_id': ''},
             'width': '10px',
         },
         {
-            'if': {'column_id': current_main_criterion},
+            'if': {'column_id': criterion},
             'width': '20px',
         },
     ]
+    return columns, style_cell_conditional
 
-    if selected_map is not None:
-        country = selected_map['points'][0]['location']
-        if '{Country}' in filter_query: #{Country} exists
-            filter_split = filter_query.split(' && ')
-            for i in range(len(filter_split)):
-                if '{Country}' in filter_split[i]: #replace {Country}
-                    filter_split[i] = '{Country} ="' + country + '"'
-            filter_query = ' && '.join(filter_split)
-        else:
-            if filter_query == '':
-                filter_query = '{Country} ="' + country + '"'
-            else:
-                filter_query = filter_query + ' && {Country} ="' + country + '"'
+@ app.callback(
+    Output(component_id="university-table", component_property="data"),
+    Output(component_id="university-table", component_property="page_current"),
+    Output(component_id="university-table", component_property="page_count"),
+    Output(component_id='university-table', component_property="selected_rows"),
+    Output(component_id="main-selection", component_property="data"),
+    Input(component_id="main-rankings", component_property="data"),
+    Input(component_id="main-slider", component_property="value"),
+    Input(component_id="criteria-dropdown", component_property="value"),
+    Input(component_id='university-table', component_property="selected_rows"),
+    Input(component_id="university-table", component_property="page_current"),
+    Input(component_id="university-table", component_property="page_size"),
+    Input(component_id="university-table", component_property="sort_by"),
+    Input(component_id="university-table", component_property="filter_query"),
+    State(component_id="university-table", component_property="data"),
+    State(component_id="main-selection", component_property="data"),
+)
+@ metrics.callback
+def update_university_table(rankings_value, main_year, criterion, selected_rows, page_current, page_size, sort_by, filter_query, rows, university_names):
+    current_store = store
+    university_rankings = Rankings(rankings_value)
+    triggered = set(ctx.triggered_prop_ids)
+
+    if selected_rows is None:
+        selected_rows = []
+
+    if university_names is None:
+        university_names = []
+
+    # update the currently selected universities
+    if 'university-table.selected_rows' in triggered:
+        # selected_rows only refers to the rows of the visible page, the selection on the other pages is kept
+        page_names = [] if rows is None else [row["University"] for row in rows]
+        selected_names = [rows[index]["University"] for index in selected_rows if index < len(page_names)]
+        new_university_names = [name for name in university_names if name not in page_names] + selected_names
+    elif triggered & {'main-rankings.data', 'main-slider.value'}:
+        # universities that are not in the new ranking or year are dropped from the selection
+        partition_names = set(current_store.partition(university_rankings.value, main_year)["University"])
+        new_university_names = [name for name in university_names if name in partition_names]
+    else:
+        new_university_names = university_names
+
+    # only a selection on the visible page changed, the rows are already in the browser
+    if triggered == {'university-table.selected_rows'}:
+        return no_update, no_update, no_update, no_update, new_university_names if new_university_names != university_names else no_update
+
+    # go back to the first page when the rows of the table change
+    if not triggered <= {'university-table.page_current', 'criteria-dropdown.value'}:
+        page_current = 0
+
+    data, page_current, page_count = load_table_page(current_store, university_rankings, main_year, criterion, filter_query, sort_by, page_current, page_size)
+    selected_index = [index for index, row in enumerate(data) if row["University"] in new_university_names]
 
     return (
-        options,
-        load_main_bar_chart(current_main_university_list, current_main_rankings, current_main_year),
-        load_main_line_chart(current_main_university_list, current_main_rankings, current_main_criterion),
-        choropleth_mapbox,
         data,
-        columns,
+        page_current,
+        page_count,
         selected_index,
-        filter_query,
-        style_cell_conditional,
-        None,
-        btn_main_times_class,
-        btn_main_shanghai_class,
-        btn_main_cwur_class,
+        new_university_names if new_university_names != university_names else no_update,
     )
 
+# Bar Chart
 @ app.callback(
-    Output("university-modal", "is_open"),
-    Output("university-name-title", "children"),
-    Output('university-table', 'selected_cells'),
-    Output('university-table', 'active_cell'),
-    Output(component_id="university-line-chart", component_property="figure"),
-    Output(component_id="university-radar-chart", component_property="figure"),
+    Output(component_id="main-bar-chart", component_property="figure"),
+    Input(component_id="main-selection", component_property="data"),
+    Input(component_id="main-rankings", component_property="data"),
+    Input(component_id="main-slider", component_property="value"),
+)
+@ metrics.callback
+def update_main_bar_chart(university_names, rankings_value, main_year):
+    return load_main_bar_chart(store, tuple(university_names or ()), Rankings(rankings_value), main_year)
+
+# Line Chart
+@ app.callback(
+    Output(component_id="main-line-chart", component_property="figure"),
+    Input(component_id="main-selection", component_property="data"),
+    Input(component_id="main-rankings", component_property="data"),
+    Input(component_id="main-slider", component_property="value"),
+    Input(component_id="criteria-dropdown", component_property="value"),
+)
+@ metrics.callback
+def update_main_line_chart(university_names, rankings_value, main_year, criterion):
+    current_store = store
+    university_rankings = Rankings(rankings_value)
+    university_names = tuple(university_names or ())
+
+    # only the criterion changed, so only the y values, hover labels, axes and title of the lines are sent
+    # the band of a larger selection is recomputed as a whole
+    if set(ctx.triggered_prop_ids) == {'criteria-dropdown.value'}:
+        if not university_names:
+            return no_update
+
+        university_list = current_store.universities(university_rankings.value, main_year, university_names)
+        if len(university_list) <= trend_max_universities:
+            history_df = load_trend_values(current_store.histories(university_rankings.value, university_list["University"].tolist()), criterion)
+            patched_fig = Patch()
+            for index, (university_name, university_df) in enumerate(history_df.groupby('Selection', sort=False)):
+                patched_fig['data'][index]['y'] = university_df["Trend"].values.tolist()
+                patched_fig['data'][index]['customdata'] = university_df["Trend Label"].values.tolist()
+                patched_fig['data'][index]['meta'] = [university_name, criterion]
+            patched_fig['layout']['title']['text'] = load_trend_title(criterion, university_rankings, len(university_list))
+            patched_fig['layout']['yaxis']['title']['text'] = criterion
+            patched_fig['layout']['yaxis']['autorange'] = "reversed" if criterion == 'World Rank' else True
+            return patched_fig
+
+    return load_main_line_chart(current_store, university_names, university_rankings, main_year, criterion)
+
+# Sliders
+# the years of the sliders follow the rankings when new years are ingested, see ingest.py
+@ app.callback(
+    Output(component_id="main-slider", component_property="min"),
+    Output(component_id="main-slider", component_property="max"),
+    Output(component_id="main-slider", component_property="marks"),
+    Output(component_id="university-year-slider", component_property="min"),
+    Output(component_id="university-year-slider", component_property="max"),
+    Output(component_id="university-year-slider", component_property="marks"),
+    Output(component_id="data-version", component_property="data"),
+    Input(component_id="data-version-interval", component_property="n_intervals"),
+    State(component_id="data-version", component_property="data"),
+    prevent_initial_call=True,
+)
+@ metrics.callback
+def update_year_sliders(n_intervals, data_version):
+    current_store = store
+    if data_version == list(current_store.versions):
+        raise PreventUpdate
+
+    first_year, last_year = current_store.year_range()
+    marks = load_year_marks(current_store)
+    return first_year, last_year, marks, first_year, last_year, marks, list(current_store.versions)
+
+# Movers
+# the movers are compared from an earlier year to the year of the slider
+@ app.callback(
+    Output(component_id="movers-from-year", component_property="options"),
+    Output(component_id="movers-from-year", component_property="value"),
+    Output(component_id="movers-country", component_property="options"),
+    Input(component_id="main-rankings", component_property="data"),
+    Input(component_id="main-slider", component_property="value"),
+    State(component_id="movers-from-year", component_property="value"),
+)
+@ metrics.callback
+def update_movers_years(rankings_value, main_year, from_year):
+    current_store = store
+    options = [year for year in current_store.years(rankings_value) if year < main_year]
+    countries = sorted(current_store.partition(rankings_value, main_year)['Country'].dropna().unique())
+    return options, from_year if from_year in options else (options[-1] if options else None), countries
+
+@ app.callback(
+    Output(component_id="movers-metric", component_property="options"),
+    Output(component_id="movers-metric", component_property="value"),
+    Input(component_id="main-rankings", component_property="data"),
+    Input(component_id="main-slider", component_property="value"),
+    Input(component_id="movers-from-year", component_property="value"),
+    State(component_id="movers-metric", component_property="value"),
+)
+@ metrics.callback
+def update_movers_metric(rankings_value, main_year, from_year, metric):
+    options = rank_metrics + (load_movers_criteria(store, Rankings(rankings_value), from_year, main_year) if from_year is not None else [])
+    return options, metric if metric in options else options[0]
+
+@ app.callback(
+    Output(component_id="movers-chart", component_property="figure"),
+    Input(component_id="main-rankings", component_property="data"),
+    Input(component_id="main-slider", component_property="value"),
+    Input(component_id="movers-from-year", component_property="value"),
+    Input(component_id="movers-metric", component_property="value"),
+    Input(component_id="movers-country", component_property="value"),
+)
+@ metrics.callback
+def update_movers_chart(rankings_value, main_year, from_year, metric, country):
+    if from_year is None or from_year >= main_year:
+        return no_earlier_year_figure
+    return load_movers_chart(store, Rankings(rankings_value), from_year, main_year, metric, country or None)
+
+# Callback for University Page
+# Buttons
+app.clientside_callback(
+    ClientsideFunction(namespace='dashboard', function_name='selectRankings'),
+    Output(component_id="university-rankings", component_property="data"),
     Output(component_id="btn-times-university", component_property="className"),
     Output(component_id="btn-shanghai-university", component_property="className"),
     Output(component_id="btn-cwur-university", component_property="className"),
-    Input('university-table', 'active_cell'),
-    Input(component_id='university-table', component_property="derived_viewport_data"),
-    Input("university-modal", "is_open"),
     Input(component_id="btn-times-university", component_property="n_clicks"),
     Input(component_id="btn-shanghai-university", component_property="n_clicks"),
     Input(component_id="btn-cwur-university", component_property="n_clicks"),
-    Input(component_id="university-year-slider", component_property="value")
 )
-def open_university_overview(active_cell, rows, is_open, btn_times, btn_shanghai, btn_cwur, year_slider):
 
-    global current_university_name
-    global current_university_rankings
-    global current_university_year
-    global btn_univ_times_class
-    global btn_univ_shanghai_class
-    global btn_univ_cwur_class
+@ app.callback(
+    Output("university-modal", "is_open"),
+    Output("university-name-title", "children"),
+    Output('university-table', 'selected_cells'),
+    Output('university-table', 'active_cell'),
+    Output(component_id="university-line-chart", component_property="figure"),
+    Output(component_id="university-radar-chart", component_property="figure"),
+    Output(component_id="university-name", component_property="data"),
+    Output('similar-table', 'active_cell'),
+    Input('university-table', 'active_cell'),
+    Input(component_id="university-rankings", component_property="data"),
+    Input(component_id="university-year-slider", component_property="value"),
+    Input('similar-table', 'active_cell'),
+    State(component_id='university-table', component_property="data"),
+    State("university-modal", "is_open"),
+    State(component_id="university-name", component_property="data"),
+    State(component_id='similar-table', component_property="data"),
+)
+@ metrics.callback
+def open_university_overview(active_cell, rankings_value, year_slider, similar_cell, rows, is_open, university_name, similar_rows):
+    current_store = store
+    university_rankings = Rankings(rankings_value)
 
     if active_cell:
         is_open = not is_open
-        current_university_name = rows[active_cell['row']]['University']
-
-    if "btn-times-university" == ctx.triggered_id:
-        current_university_rankings = Rankings.times
-        btn_univ_times_class = activated_class
-        btn_univ_shanghai_class = deactivated_class
-        btn_univ_cwur_class = deactivated_class
-    elif "btn-shanghai-university" == ctx.triggered_id:
-        current_university_rankings = Rankings.shanghai
-        btn_univ_times_class = deactivated_class
-        btn_univ_shanghai_class = activated_class
-        btn_univ_cwur_class = deactivated_class
-    elif "btn-cwur-university" == ctx.triggered_id:
-        current_university_rankings = Rankings.cwur
-        btn_univ_times_class = deactivated_class
-        btn_univ_shanghai_class = deactivated_class
-        btn_univ_cwur_class = activated_class
-
-    current_university_year = year_slider
+        university_name = rows[active_cell['row']]['University']
+    elif similar_cell:
+        # a similar university replaces the university of the open overview
+        university_name = similar_rows[similar_cell['row']]['University']
+
+    university_year = year_slider
 
     return (
         is_open,
-        current_university_name,
+        university_name,
         [],
         None,
-        load_university_line_chart(current_university_rankings, current_university_name),
-        load_university_radar_chart(current_university_name, current_university_year),
-        btn_univ_times_class,
-        btn_univ_shanghai_class,
-        btn_univ_cwur_class
+        load_university_line_chart(current_store, university_rankings, university_name),
+        load_university_radar_chart(current_store, university_name, university_year),
+        university_name,
+        None,
     )
 
+# Similar Universities
+@ app.callback(
+    Output(component_id="similar-title", component_property="children"),
+    Output(component_id="similar-table", component_property="data"),
+    Input(component_id="university-name", component_property="data"),
+    Input(component_id="university-rankings", component_property="data"),
+    Input(component_id="university-year-slider", component_property="value"),
+)
+@ metrics.callback
+def update_similar_universities(university_name, rankings_value, university_year):
+    university_rankings = Rankings(rankings_value)
+    rows = load_similar_universities(store, university_rankings, university_name, university_year)
+    if not rows:
+        return "No Similar Universities in the {} {}".format(university_year, rankings_names[university_rankings.value]), rows
+    return "Universities Closest to {} by their {} {} Criteria".format(university_name, university_year, rankings_names[university_rankings.value]), rows
+
+# requests replaced by newer ones of the same page are skipped, see render_versions.py
+render_versions.instrument_app(app)
+metrics.instrument_app(app)
+http_cache.register(server)
+
+# read-only export of the rankings for machine consumers, see export.py
+register_export_routes(server, lambda: store, {university_rankings.name: university_rankings.value for university_rankings in Rankings})
+
+# Warm-up
+# with WARMUP=1 the map of every ranking and year and the university page of the WARMUP_TOP_UNIVERSITIES best
+# universities of every ranking are built by WARMUP_WORKERS processes in the background, see warmup.py
+# the table partitions and dropdown options need no warm-up, the store computes them when it loads
+def load_warmup_tasks(store, top_universities):
+    for university_rankings in Rankings:
+        for year in store.years(university_rankings.value):
+            yield load_choropleth_map, (university_rankings, year, country_base_metrics[0])
+    for university_rankings in Rankings:
+        latest_df = store.partition(university_rankings.value, max(store.years(university_rankings.value)))
+        for university_name in latest_df.sort_values(by='World Rank Order')['University'][:top_universities]:
+            yield load_university_line_chart, (university_rankings, university_name)
+            yield load_university_radar_chart, (university_name, default_university_year)
+
+warmup = Warmup(figure_cache, lambda: store, int(os.environ['WARMUP_WORKERS']) if 'WARMUP_WORKERS' in os.environ else None)
+metrics.gauge('dashboard_warmup_figures', 'Figures queued by the warm-up', lambda: warmup.progress()['total'])
+metrics.gauge('dashboard_warmup_figures_done', 'Figures of the warm-up that are built or were already cached', lambda: warmup.progress()['done'])
+metrics.gauge('dashboard_warmup_figures_failed', 'Figures of the warm-up that failed to build', lambda: warmup.progress()['failed'])
+warmup_top_universities = int(os.environ.get('WARMUP_TOP_UNIVERSITIES', 20))
+if os.environ.get('WARMUP', '0') == '1':
+    warmup.start(load_warmup_tasks(store, warmup_top_universities))
+
+    # every worker forked from a preloaded server (gunicorn --preload) warms up the figures it did not inherit
+    @ server.before_request
+    def warm_up_process():
+        warmup.start_process(lambda: load_warmup_tasks(store, warmup_top_universities))
+
+# the ingest thread is started by the first request of every process that serves, so that every worker forked
+# from a preloaded server (gunicorn --preload) refreshes its own store, and after the warm-up workers are forked
+@ server.before_request
+def watch_datasets():
+    if datasets_watch_seconds > 0:
+        ingest.watch_process(datasets_watch_seconds, refresh_datasets)
+
+# the objects of the loaded rankings are left out of the garbage collections, so the workers forked from a
+# preloaded server (gunicorn --preload) do not copy their pages by collecting them
+gc.freeze()
+
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     app.run_server()  # run server
@@ -0,0 +1,96 @@
+// Clientside callbacks of the dashboard, for the logic that does not need the datasets
+
+const activatedClass = 'btn btn-primary mx-3';
+const deactivatedClass = 'btn btn-secondary mx-3';
+
+// in the order of the Rankings enum in app.py
+const rankings = ['times', 'shanghai', 'cwur'];
+
+// Every callback request of the page carries the id of the page and a growing sequence number, so the server
+// can skip the requests that a newer one for the same outputs replaced, see render_versions.py
+const renderPage = Math.random().toString(36).slice(2) + Date.now().toString(36);
+let renderSequence = 0;
+
+// The requests of the figure callbacks also carry the ETag of the figures the page shows, so the server answers
+// 204 (no update) when the new figures are the same, see http_cache.py. The renderer drops the response of a
+// request replaced by a newer one, so only the response of the latest request of an output is recorded.
+const shownFigures = {};
+const latestSequences = {};
+const requestedOutputs = {};
+
+window.dashboardRender = {
+    stamp: function (payload) {
+        renderSequence += 1;
+        payload.render = {page: renderPage, sequence: renderSequence};
+        if (shownFigures[payload.output]) {
+            payload.render.shown = shownFigures[payload.output];
+        }
+        latestSequences[payload.output] = renderSequence;
+        requestedOutputs[renderSequence] = payload.output;
+    },
+
+    record: function (sequence, response) {
+        const output = requestedOutputs[sequence];
+        delete requestedOutputs[sequence];
+        if (output === undefined || latestSequences[output] !== sequence || response.status !== 200) {
+            return;
+        }
+        const etag = response.headers.get('ETag');
+        if (etag) {
+            shownFigures[output] = etag.replace(/^W\//, '').replace(/"/g, '');
+        } else {
+            delete shownFigures[output];
+        }
+    },
+};
+
+// the ETags are response headers, which the renderer hooks do not see
+const nativeFetch = window.fetch;
+window.fetch = function (resource, options) {
+    const result = nativeFetch.apply(this, arguments);
+    const body = options && typeof options.body === 'string' ? options.body : '';
+    // the stamp is the last property of the payload
+    const start = body.lastIndexOf('"render":');
+    if (start < 0 || !String(resource).includes('_dash-update-component')) {
+        return result;
+    }
+    const sequence = JSON.parse(body.slice(start + '"render":'.length, -1)).sequence;
+    return result.then(response => {
+        window.dashboardRender.record(sequence, response);
+        return response;
+    });
+};
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    dashboard: {
+        // Selected ranking and the classes of its times, shanghai and cwur buttons
+        selectRankings: function () {
+            const triggered = dash_clientside.callback_context.triggered.map(trigger => trigger.prop_id);
+            let selected = 0;
+            rankings.forEach((name, index) => {
+                if (triggered.some(propId => propId.startsWith('btn-' + name + '-'))) {
+                    selected = index;
+                }
+            });
+            return [selected].concat(rankings.map((name, index) => index === selected ? activatedClass : deactivatedClass));
+        },
+
+        // Adds the country clicked on the map to the filter of the table, or replaces the country already in it
+        filterMapCountry: function (selectedMap, filterQuery) {
+            if (!selectedMap) {
+                return [dash_clientside.no_update, dash_clientside.no_update];
+            }
+
+            filterQuery = filterQuery || '';
+            const countryFilter = '{Country} ="' + selectedMap.points[0].location + '"';
+            if (filterQuery.includes('{Country}')) {
+                filterQuery = filterQuery.split(' && ').map(part => part.includes('{Country}') ? countryFilter : part).join(' && ');
+            } else if (filterQuery === '') {
+                filterQuery = countryFilter;
+            } else {
+                filterQuery = filterQuery + ' && ' + countryFilter;
+            }
+            return [filterQuery, null];
+        },
+    },
+});
@@ -0,0 +1,396 @@
+# -*- coding: utf-8 -*-
+
+# Callback microbenchmarks
+# Every scale runs in its own process, against the bundled datasets (scale 1) or a synthetic copy of them with
+# N times the universities, and calls the callbacks headlessly through the Dash update endpoint of the Flask
+# test client, so the timings include the serialization of the responses.
+#
+# python benchmark.py [--scales 1 10 100] [--repeat 5] [--output benchmark.json] [--baseline old.json]
+
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from http_cache import decompress
+
+rankings_files = [('times.csv', {}), ('shanghai.csv', {'encoding': 'cp1252'}), ('cwur.csv', {})]
+
+
+# Synthetic Datasets
+# Copies every ranking `scale` times with renamed universities and jittered scores, keeping the schema of the CSVs
+def generate_synthetic_datasets(source_dir, target_dir, scale, seed=0):
+    rng = np.random.default_rng(seed)
+    os.makedirs(target_dir, exist_ok=True)
+
+    for file_name, read_options in rankings_files:
+        df = pd.read_csv(os.path.join(source_dir, file_name), **read_options)
+        score_columns = [column for column in df.columns if df[column].dtype == float]
+
+        copies = [df]
+        for copy in range(1, scale):
+            copy_df = df.copy()
+            copy_df['University'] = copy_df['University'] + ' ({})'.format(copy)
+            copy_df[score_columns] = (copy_df[score_columns] + rng.normal(0, 2, size=(len(df), len(score_columns)))).clip(lower=0).round(1)
+            copies.append(copy_df)
+
+        synthetic_df = pd.concat(copies, ignore_index=True).sort_values(by=['Year', 'World Rank Order'], kind='stable')
+        synthetic_df['World Rank Order'] = synthetic_df.groupby('Year').cumcount() + 1
+        synthetic_df.to_csv(os.path.join(target_dir, file_name), index=False, encoding=read_options.get('encoding', 'utf-8'))
+
+    for file_name in ('countries.geojson', '.mapbox_token', 'university_overrides.csv'):
+        if os.path.exists(os.path.join(source_dir, file_name)):
+            shutil.copy2(os.path.join(source_dir, file_name), os.path.join(target_dir, file_name))
+
+
+# Headless Callbacks
+def find_callback(dashboard, output):
+    return next(key for key in dashboard.app.callback_map if output in key.strip('.').split('...'))
+
+
+# Calls the callback of `output` with the property values of a simulated browser session, then applies its
+# response to the session like the Dash renderer would. Like a browser, the client accepts compressed responses
+# and, given the render stamp of its page and the ETags of the figures it shows (callback key -> ETag, updated
+# here), gets a 204 for figures it already has.
+# Returns (response, decompressed body)
+def call_callback(client, dashboard, session, output, changed=(), render=None, shown=None):
+    key = find_callback(dashboard, output)
+    callback = dashboard.app.callback_map[key]
+    outputs = [{'id': prop_id.rsplit('.', 1)[0], 'property': prop_id.rsplit('.', 1)[1]} for prop_id in key.strip('.').split('...')]
+
+    def dependencies(items):
+        return [dict(item, value=session.get('{}.{}'.format(item['id'], item['property']))) for item in items]
+
+    payload = {
+        'output': key,
+        'outputs': outputs if key.startswith('..') else outputs[0],
+        'inputs': dependencies(callback['inputs']),
+        'state': dependencies(callback.get('state', [])),
+        'changedPropIds': list(changed),
+    }
+    if render is not None:
+        payload['render'] = dict(render, shown=shown[key]) if shown and key in shown else render
+    response = client.post('/_dash-update-component', json=payload, headers={'Accept-Encoding': 'gzip, deflate, br'})
+    body = decompress(response.data, response.headers.get('Content-Encoding'))
+    if response.status_code == 200:
+        if shown is not None:
+            shown[key] = response.get_etag()[0]
+        for component_id, props in json.loads(body)['response'].items():
+            for prop, value in props.items():
+                # partial updates are not applied, the simulated session keeps the previous value
+                if not (isinstance(value, dict) and '__dash_patch_update' in value):
+                    session['{}.{}'.format(component_id, prop)] = value
+    return response, body
+
+
+# Scenarios
+# A scenario is a list of steps (changed properties, outputs of the callbacks they trigger)
+main_outputs = ['criteria-dropdown.options', 'map-metric-dropdown.options', 'choropleth_map.figure', 'university-table.data', 'main-bar-chart.figure', 'main-line-chart.figure']
+
+
+def initial_session(dashboard):
+    return {
+        'main-rankings.data': dashboard.default_main_rankings.value,
+        'main-slider.value': dashboard.default_main_year,
+        'criteria-dropdown.value': dashboard.default_main_criterion,
+        'map-metric-dropdown.value': 'Universities',
+        'main-selection.data': [],
+        'choropleth-rendered.data': False,
+        'university-table.selected_rows': [],
+        'university-table.page_current': 0,
+        'university-table.page_size': 5,
+        'university-table.sort_by': [],
+        'university-table.filter_query': '',
+        'university-table.data': [],
+        'university-table.active_cell': None,
+        'university-modal.is_open': False,
+        'university-rankings.data': dashboard.default_university_rankings.value,
+        'university-name.data': dashboard.default_university_name,
+        'university-year-slider.value': dashboard.default_university_year,
+        'movers-from-year.value': None,
+        'movers-metric.value': 'World Rank',
+        'movers-country.value': None,
+        'similar-table.data': [],
+        'similar-table.active_cell': None,
+    }
+
+
+def load_scenarios(dashboard):
+    def select(count):
+        names = dashboard.store.partition(dashboard.default_main_rankings.value, dashboard.default_main_year)['University'][:count].tolist()
+        return [({'main-selection.data': names}, ['main-bar-chart.figure', 'main-line-chart.figure'])]
+
+    scenarios = {
+        'initial load': [({}, main_outputs + ['university-table.columns', 'university-modal.is_open'])],
+        'switch ranking': [({'main-rankings.data': rankings.value}, main_outputs) for rankings in dashboard.Rankings],
+        # the figures of the second step are the ones the page already has, they are answered with a 204
+        'reselect ranking': [({'main-rankings.data': dashboard.default_main_rankings.value}, main_outputs)] * 2,
+        'move slider': [({'main-slider.value': year}, main_outputs) for year in range(2012, 2023)],
+        'select row': [({'university-table.selected_rows': [0]}, ['university-table.data', 'main-bar-chart.figure', 'main-line-chart.figure'])],
+        'change criterion': select(5) + [({'criteria-dropdown.value': 'World Rank'}, ['university-table.columns', 'university-table.data', 'main-line-chart.figure'])],
+        'filter country': [({'university-table.filter_query': '{Country} ="United States of America"'}, ['university-table.data'])],
+        'movers': [
+            ({}, ['movers-from-year.options', 'movers-metric.options', 'movers-chart.figure']),
+            ({'movers-metric.value': 'Overall Score'}, ['movers-chart.figure']),
+            ({'movers-country.value': 'United States of America'}, ['movers-chart.figure']),
+        ],
+        'open university overview': [({'university-table.active_cell': {'row': 0, 'column': 1}}, ['university-modal.is_open', 'similar-title.children'])],
+        'similar universities': [
+            ({'university-year-slider.value': 2015}, ['university-modal.is_open', 'similar-title.children']),
+            ({'similar-table.active_cell': {'row': 0, 'column': 1}}, ['university-modal.is_open']),
+        ],
+    }
+    for count in (1, 5, 20, 100):
+        scenarios['select {} universities'.format(count)] = select(count)
+    return scenarios
+
+
+# Every run is a page of its own, whose requests are stamped like those of the renderer
+def run_scenario(client, dashboard, session, steps, trace_memory=False):
+    measurements = []
+    render = {'page': uuid.uuid4().hex, 'sequence': 0}
+    shown = {}
+    for changes, outputs in steps:
+        session.update(changes)
+        for output in outputs:
+            if trace_memory:
+                tracemalloc.reset_peak()
+                start_memory = tracemalloc.get_traced_memory()[0]
+            render['sequence'] += 1
+            start = time.perf_counter()
+            response, body = call_callback(client, dashboard, session, output, changed=list(changes), render=dict(render), shown=shown)
+            elapsed = time.perf_counter() - start
+            measurements.append({
+                'callback': output,
+                'status': response.status_code,
+                'ms': elapsed * 1000,
+                'bytes': len(body),
+                'wire_bytes': len(response.data),
+                'peak_kb': (tracemalloc.get_traced_memory()[1] - start_memory) / 1024 if trace_memory else None,
+            })
+    return measurements
+
+
+# Similar Universities
+# the per-row pandas search that RankingStore.similar_universities replaces, for comparison
+def naive_similar_universities(partition_df, criteria, university_name, count, min_shared_fraction=0.5):
+    values = partition_df[criteria].astype(float)
+    std = values.std(ddof=0).replace(0, 1).fillna(1)
+    standardized = (values - values.mean()) / std
+    query_id = partition_df.loc[partition_df['University'] == university_name, 'University ID'].iloc[0]
+    query = standardized[partition_df['University'] == university_name].iloc[0]
+
+    distances = {}
+    for index, row in standardized.iterrows():
+        shared = row.notna() & query.notna()
+        if partition_df.at[index, 'University ID'] == query_id or shared.sum() < max(1, min_shared_fraction * query.notna().sum()):
+            continue
+        distances[index] = float(np.sqrt(((row[shared] - query[shared]) ** 2).sum() * len(criteria) / shared.sum()))
+    nearest = sorted(distances, key=distances.get)[:count]
+    return partition_df.loc[nearest].assign(Distance=[distances[index] for index in nearest])
+
+
+naive_similarity_max_rows = 20000
+
+
+def run_similarity_benchmark(dashboard, repeat):
+    store = dashboard.store
+    ranking, year, university_name = dashboard.default_university_rankings.value, dashboard.default_university_year, dashboard.default_university_name
+    partition_df = store.partition(ranking, year)
+
+    def timed(func, runs):
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            result = func()
+            times.append((time.perf_counter() - start) * 1000)
+        return result, statistics.median(times)
+
+    vectorized_df, vectorized_ms = timed(lambda: store.similar_universities(ranking, university_name, year, dashboard.similar_count), max(repeat, 1) * 10)
+    # the naive search takes about a millisecond per row, it runs once and only on the smaller datasets
+    if len(partition_df) > naive_similarity_max_rows:
+        return {'rows': len(partition_df), 'vectorized_ms': round(vectorized_ms, 3), 'naive_ms': None, 'same_universities': None}
+    naive_df, naive_ms = timed(lambda: naive_similar_universities(partition_df, store.year_columns(ranking, year), university_name, dashboard.similar_count), 1)
+    return {
+        'rows': len(partition_df),
+        'vectorized_ms': round(vectorized_ms, 3),
+        'naive_ms': round(naive_ms, 3),
+        'same_universities': vectorized_df['University'].tolist() == naive_df['University'].tolist(),
+    }
+
+
+# Page Load
+# Bytes of the page, its layout, its callback graph and its scripts: uncompressed, as sent to a browser that accepts
+# gzip, and when the browser revalidates them with their ETags
+def run_page_load(client):
+    paths = ['/', '/_dash-layout', '/_dash-dependencies']
+    page = client.get('/').get_data(as_text=True)
+    paths += [path for path in re.findall(r'<script src="([^"]+)"', page) if path.startswith('/')]
+
+    resources = []
+    for path in paths:
+        raw = client.get(path)
+        compressed = client.get(path, headers={'Accept-Encoding': 'gzip'})
+        etag = compressed.headers.get('ETag')
+        revalidated = client.get(path, headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}) if etag else None
+        resources.append({
+            'path': path.split('?')[0],
+            'bytes': len(raw.data),
+            'wire_bytes': len(compressed.data),
+            'revalidated_status': revalidated.status_code if revalidated is not None else None,
+            'revalidated_bytes': len(revalidated.data) if revalidated is not None else None,
+        })
+    return resources
+
+
+# Runs every scenario of one dataset, in the process that imported the app
+def run_benchmarks(repeat):
+    start = time.perf_counter()
+    import app as dashboard
+    startup = time.perf_counter() - start
+
+    client = dashboard.server.test_client()
+    client.get('/')
+
+    base_session = initial_session(dashboard)
+    run_scenario(client, dashboard, base_session, load_scenarios(dashboard)['initial load'])
+
+    results = []
+    for scenario, steps in load_scenarios(dashboard).items():
+        # cold: nothing of the scenario is in the figure cache
+        dashboard.figure_cache.clear()
+        cold = run_scenario(client, dashboard, dict(base_session), steps)
+
+        dashboard.figure_cache.clear()
+        tracemalloc.start()
+        traced = run_scenario(client, dashboard, dict(base_session), steps, trace_memory=True)
+        tracemalloc.stop()
+
+        warm = [run_scenario(client, dashboard, dict(base_session), steps) for _ in range(repeat)]
+
+        for index, measurement in enumerate(cold):
+            results.append({
+                'scenario': scenario,
+                'step': index,
+                'callback': measurement['callback'],
+                'status': measurement['status'],
+                'cold_ms': round(measurement['ms'], 3),
+                'warm_ms': round(statistics.median(run[index]['ms'] for run in warm), 3) if warm else None,
+                'bytes': measurement['bytes'],
+                'wire_bytes': measurement['wire_bytes'],
+                'peak_kb': round(traced[index]['peak_kb'], 1),
+            })
+
+    return {
+        'rows': int(sum(len(df) for df in dashboard.rankings_df)),
+        'startup_s': round(startup, 3),
+        'figure_cache': dashboard.figure_cache.stats(),
+        'similarity': run_similarity_benchmark(dashboard, repeat),
+        'page_load': run_page_load(client),
+        'http_cache': dashboard.http_cache.stats(),
+        'results': results,
+    }
+
+
+# Runs the benchmarks of every scale in a process of its own, generating the synthetic datasets when needed
+def run_scales(scales, repeat, work_dir):
+    reports = []
+    for scale in scales:
+        datasets_dir = 'datasets'
+        if scale != 1:
+            datasets_dir = os.path.join(work_dir, 'datasets-x{}'.format(scale))
+            if not os.path.exists(os.path.join(datasets_dir, 'cwur.csv')):
+                generate_synthetic_datasets('datasets', datasets_dir, scale)
+
+        env = dict(os.environ, DATASETS_DIR=datasets_dir, DATASET_CACHE_DIR=os.path.join(work_dir, 'cache-x{}'.format(scale)))
+        output = subprocess.run([sys.executable, __file__, '--run', '--repeat', str(repeat)], env=env, check=True, stdout=subprocess.PIPE, text=True).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+        report['scale'] = scale
+        reports.append(report)
+    return reports
+
+
+def print_reports(reports):
+    print('{:>6} {:<26} {:<30} {:>6} {:>10} {:>10} {:>12} {:>12} {:>10}'.format('scale', 'scenario', 'callback', 'status', 'cold ms', 'warm ms', 'bytes', 'wire bytes', 'peak KB'))
+    for report in reports:
+        print('x{:<5} {} rows, startup {:.3f} s'.format(report['scale'], report['rows'], report['startup_s']))
+        similarity = report.get('similarity')
+        if similarity and similarity['naive_ms'] is None:
+            print('{:>6} similar universities among {} rows: {:.2f} ms vectorized'.format('', similarity['rows'], similarity['vectorized_ms']))
+        elif similarity:
+            print('{:>6} similar universities among {} rows: {:.2f} ms vectorized, {:.2f} ms per-row pandas ({:.0f}x){}'.format(
+                '', similarity['rows'], similarity['vectorized_ms'], similarity['naive_ms'], similarity['naive_ms'] / max(similarity['vectorized_ms'], 1e-9),
+                '' if similarity['same_universities'] else ', DIFFERENT universities'))
+        page_load = report.get('page_load')
+        if page_load:
+            print('{:>6} page load: {} bytes, {} bytes gzipped, {} bytes revalidated ({} of {} resources not modified)'.format(
+                '', sum(resource['bytes'] for resource in page_load), sum(resource['wire_bytes'] for resource in page_load),
+                sum(resource['revalidated_bytes'] or 0 for resource in page_load),
+                sum(resource['revalidated_status'] == 304 for resource in page_load), len(page_load)))
+        for result in report['results']:
+            print('{:>6} {:<26} {:<30} {:>6} {:>10.2f} {:>10.2f} {:>12} {:>12} {:>10.1f}'.format(
+                'x{}'.format(report['scale']), result['scenario'], result['callback'], result['status'],
+                result['cold_ms'], result['warm_ms'] or 0, result['bytes'], result.get('wire_bytes', ''), result['peak_kb']))
+        print('{:>6} callbacks: {} bytes, {} bytes on the wire'.format(
+            '', sum(result['bytes'] for result in report['results']), sum(result.get('wire_bytes', result['bytes']) for result in report['results'])))
+
+
+# Steps that got slower or bigger than the baseline by more than `threshold`, ignoring slowdowns under `min_ms`
+def find_regressions(reports, baseline_reports, threshold, min_ms):
+    baseline = {
+        (report['scale'], result['scenario'], result['step'], result['callback']): result
+        for report in baseline_reports for result in report['results']
+    }
+    regressions = []
+    for report in reports:
+        for result in report['results']:
+            previous = baseline.get((report['scale'], result['scenario'], result['step'], result['callback']))
+            if previous is None:
+                continue
+            for metric, noise in (('cold_ms', min_ms), ('warm_ms', min_ms), ('bytes', 0)):
+                if result[metric] is not None and previous[metric] is not None and result[metric] > previous[metric] * threshold + noise:
+                    regressions.append('x{} {} / {}: {} {} -> {}'.format(report['scale'], result['scenario'], result['callback'], metric, previous[metric], result[metric]))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the dashboard callbacks on the bundled and synthetic datasets')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='dataset sizes, as multiples of the bundled datasets')
+    parser.add_argument('--repeat', type=int, default=5, help='warm runs of every scenario')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.5, help='slowdown or growth factor reported as a regression')
+    parser.add_argument('--min-ms', type=float, default=5, help='slowdowns smaller than this are timing noise')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'dashboard-benchmark'), help='directory of the synthetic datasets and their caches')
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_benchmarks(args.repeat)))
+        sys.exit(0)
+
+    reports = run_scales(args.scales, args.repeat, args.work_dir)
+    print_reports(reports)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'reports': reports}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(reports, json.load(f)['reports'], args.threshold, args.min_ms)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        print('{} regression(s) against {}'.format(len(regressions), args.baseline))
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Typed binary cache of the ranking CSVs
+# Every column is stored as a .npy file, text columns as integer codes into their sorted distinct values, which are
+# read back as categoricals. The columns are loaded into memory: the rankings are concatenated and narrowed to
+# compact dtypes after loading (see ingest.py), which copies them anyway.
+# The cache of a file is rebuilt when the mtime or size of the source changed and its content hash no longer matches.
+# Every build writes its columns to a directory of its own, and meta.json, replaced atomically, names the current one.
+
+cache_dir = os.environ.get('DATASET_CACHE_DIR', '.cache')
+cache_version = 3
+
+
+def file_hash(path):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def read_meta(directory):
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(directory, meta):
+    with open(os.path.join(directory, 'meta.json.tmp'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(directory, 'meta.json.tmp'), os.path.join(directory, 'meta.json'))
+
+
+# Whether the cache still matches its source, only hashing the source when its mtime or size changed
+def is_fresh(directory, meta, source, read_options):
+    if meta is None or meta.get('version') != cache_version or meta.get('read_options') != read_options:
+        return False
+
+    fingerprint = file_fingerprint(source)
+    if meta['source'] == fingerprint:
+        return True
+    if meta['hash'] != file_hash(source):
+        return False
+
+    # the file was touched but not changed
+    meta['source'] = fingerprint
+    write_meta(directory, meta)
+    return True
+
+
+def write_columns(directory, df, source, read_options):
+    os.makedirs(directory, exist_ok=True)
+    columns_dir = tempfile.mkdtemp(dir=directory, prefix='columns-')
+
+    columns = []
+    for index, name in enumerate(df.columns):
+        values = df[name]
+        if values.dtype == object:
+            codes, categories = pd.factorize(values, sort=True)
+            np.save(os.path.join(columns_dir, '{}.npy'.format(index)), codes.astype(np.int32))
+            columns.append({'name': name, 'dtype': 'object', 'categories': categories.tolist()})
+        else:
+            np.save(os.path.join(columns_dir, '{}.npy'.format(index)), values.to_numpy())
+            columns.append({'name': name, 'dtype': str(values.dtype)})
+
+    # the new columns only become current when meta.json is replaced
+    write_meta(directory, {
+        'version': cache_version,
+        'source': file_fingerprint(source),
+        'hash': file_hash(source),
+        'read_options': read_options,
+        'columns_dir': os.path.basename(columns_dir),
+        'columns': columns,
+    })
+
+    # the columns of the previous builds, a reader that still loads them parses the CSV instead (see read_csv)
+    current = (read_meta(directory) or {}).get('columns_dir')
+    for entry in os.listdir(directory):
+        if entry not in ('meta.json', current, os.path.basename(columns_dir)):
+            path = os.path.join(directory, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+
+def read_columns(directory, meta):
+    data = {}
+    for index, column in enumerate(meta['columns']):
+        values = np.load(os.path.join(directory, meta['columns_dir'], '{}.npy'.format(index)))
+        if column['dtype'] == 'object':
+            # -1 marks missing values
+            values = pd.Categorical.from_codes(values, column['categories'])
+        data[column['name']] = values
+    return pd.DataFrame(data)
+
+
+# pd.read_csv backed by the binary cache
+def read_csv(source, **read_options):
+    name = os.path.splitext(os.path.basename(source))[0]
+    directory = os.path.join(cache_dir, '{}-{}'.format(name, hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:8]))
+    meta = read_meta(directory)
+    if is_fresh(directory, meta, source, read_options):
+        try:
+            return read_columns(directory, meta)
+        except (OSError, ValueError):
+            # the columns were replaced by a newer build since meta.json was read, the cache is written again
+            pass
+
+    df = pd.read_csv(source, **read_options)
+    try:
+        write_columns(directory, df, source, read_options)
+    except OSError:
+        # a read-only deployment still works, it just parses the CSV every time
+        pass
+    return df
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import io
+import json
+
+import flask
+
+from store import display_frame
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Read-only export API of the rankings, served on the Flask server of the dashboard
+# GET <route>/<ranking>/<year>[?country=...&university=...]     universities of a ranking in a year
+# GET <route>/<ranking>/history?university=...                  all the years of a university in a ranking
+# with format=csv (default), jsonl or arrow (Arrow IPC stream, needs pyarrow)
+# The rows are streamed in chunks of chunk_rows, and every response has an ETag derived from the version of the
+# ranking it was read from, so a client can revalidate with If-None-Match instead of downloading it again.
+
+chunk_rows = 2000
+
+formats = {
+    # Flask adds the charset of the text types
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+# chunks of the rows with plain dtypes, see store.display_frame
+def chunks(df):
+    for start in range(0, len(df), chunk_rows):
+        yield display_frame(df.iloc[start:start + chunk_rows])
+
+
+def stream_csv(df):
+    yield display_frame(df.iloc[0:0]).to_csv(index=False)
+    for chunk_df in chunks(df):
+        yield chunk_df.to_csv(index=False, header=False)
+
+
+def stream_jsonl(df):
+    for chunk_df in chunks(df):
+        lines = chunk_df.to_json(orient='records', lines=True, force_ascii=False)
+        # pandas 2 ends the lines of a chunk with a newline, older versions do not
+        yield lines if lines.endswith('\n') else lines + '\n'
+
+
+def stream_arrow(df):
+    sink = io.BytesIO()
+    schema = pa.Schema.from_pandas(display_frame(df.iloc[0:0]), preserve_index=False)
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for chunk_df in chunks(df):
+            writer.write_batch(pa.RecordBatch.from_pandas(chunk_df, schema=schema, preserve_index=False))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    yield sink.getvalue()
+
+
+streams = {'csv': stream_csv, 'jsonl': stream_jsonl, 'arrow': stream_arrow}
+
+
+def abort(status, message):
+    flask.abort(flask.Response(json.dumps({'error': message}), status=status, mimetype='application/json'))
+
+
+# Streamed response of a slice of a ranking, or 304 when the client already has this version of it
+def export_response(df, version, export_format, parameters):
+    if export_format not in formats:
+        abort(400, 'format must be one of {}'.format(', '.join(formats)))
+    if export_format == 'arrow' and pa is None:
+        abort(406, 'the arrow format needs pyarrow, which is not installed')
+
+    etag = hashlib.sha1(json.dumps([version, export_format, parameters]).encode()).hexdigest()
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(streams[export_format](df), mimetype=formats[export_format])
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# Registers the export routes, get_store returns the current RankingStore and rankings maps the ranking names
+# of the URLs to their index
+def register_export_routes(server, get_store, rankings, route='/api/rankings'):
+    def ranking_index(ranking):
+        if ranking not in rankings:
+            abort(404, 'unknown ranking {}, expected one of {}'.format(ranking, ', '.join(rankings)))
+        return rankings[ranking]
+
+    def export_year(ranking, year):
+        # one snapshot of the rankings for the whole response
+        store = get_store()
+        index = ranking_index(ranking)
+        if year not in store.years(index):
+            abort(404, 'no {} ranking in {}'.format(ranking, year))
+
+        country = flask.request.args.get('country')
+        university = flask.request.args.get('university')
+        df = store.partition(index, year)
+        if country is not None:
+            df = df[df['Country'] == country]
+        if university is not None:
+            df = df[df['University ID'] == store.university_id(index, university)]
+        return export_response(df, store.versions[index], flask.request.args.get('format', 'csv'), [ranking, year, country, university])
+
+    def export_history(ranking):
+        store = get_store()
+        index = ranking_index(ranking)
+        university = flask.request.args.get('university')
+        if university is None:
+            abort(400, 'the university parameter is required')
+        return export_response(store.history(index, university), store.versions[index], flask.request.args.get('format', 'csv'), [ranking, 'history', university])
+
+    server.add_url_rule('{}/<ranking>/<int:year>'.format(route), 'export_year', export_year, methods=['GET'])
+    server.add_url_rule('{}/<ranking>/history'.format(route), 'export_history', export_history, methods=['GET'])
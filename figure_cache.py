@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import functools
+import json
+import threading
+
+from plotly.utils import PlotlyJSONEncoder
+
+
+# Serialized size of a figure, only computed when the cache has a memory bound
+def figure_size(fig):
+    if hasattr(fig, 'to_plotly_json'):
+        fig = fig.to_plotly_json()
+    return len(json.dumps(fig, cls=PlotlyJSONEncoder))
+
+
+# Bounded LRU cache for the figures returned by the chart builders
+# Figures are keyed on (builder name, canonical inputs) and must not be mutated by the callers
+class FigureCache:
+    def __init__(self, max_entries=256, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, fig):
+        size = figure_size(fig) if self.max_bytes is not None else 0
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.sizes.pop(key)
+                del self.entries[key]
+            self.entries[key] = fig
+            self.sizes[key] = size
+            self.total_bytes += size
+            self.evict()
+
+    # drops the least recently used figures until the cache is within its bounds again
+    def evict(self):
+        while self.entries and (
+            (self.max_entries is not None and len(self.entries) > self.max_entries)
+            or (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            key, _ = self.entries.popitem(last=False)
+            self.total_bytes -= self.sizes.pop(key)
+            self.evictions += 1
+
+    # drops every figure, or only those of the given builder, or only those built from one of the given versions
+    # of the data, which the keys hold first after the builder name (see memoize)
+    def invalidate(self, name=None, versions=None):
+        def stale(key):
+            key_versions = key[1] if len(key) > 1 and isinstance(key[1], tuple) else key[1:2]
+            return versions is None or any(version in versions for version in key_versions)
+
+        with self.lock:
+            keys = [key for key in self.entries if (name is None or key[0] == name) and stale(key)]
+            for key in keys:
+                del self.entries[key]
+                self.total_bytes -= self.sizes.pop(key)
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
+
+    # decorator for a chart builder, key_func maps the builder arguments to their canonical form, the version or
+    # tuple of versions of the data the figure is built from first
+    def memoize(self, name, key_func):
+        def decorator(builder):
+            @functools.wraps(builder)
+            def wrapper(*args):
+                key = (name,) + tuple(key_func(*args))
+                fig = self.get(key)
+                if fig is None:
+                    fig = builder(*args)
+                    self.put(key, fig)
+                return fig
+            wrapper.uncached = builder
+            wrapper.cache_key = lambda *args: (name,) + tuple(key_func(*args))
+            return wrapper
+        return decorator
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+
+# Prebuilt figure skeletons
+# Building a plotly figure validates every property it is given, which costs more than filling in the data of the
+# small charts of the dashboard. A skeleton (layout, subplot grid and trace stubs with their styles and
+# hovertemplates) is built and validated once as a plotly figure and kept as its JSON dict. A chart is then a copy
+# of the skeleton with only its data arrays and titles filled in, which is not validated again.
+# The dicts of a skeleton are shared by the charts filled from it, so neither must be mutated.
+
+
+class FigureTemplate:
+    def __init__(self, fig):
+        skeleton = fig.to_plotly_json()
+        self.data = skeleton['data']
+        self.layout = skeleton['layout']
+
+    # figure dict with the properties of every trace stub updated by the dict of the same position in traces,
+    # and the layout properties updated by layout, merged one level deep, e.g. {'title': {'text': ...}}
+    def fill(self, traces=(), layout=None):
+        traces = list(traces)
+        data = [dict(stub, **values) for stub, values in zip(self.data, traces + [{}] * (len(self.data) - len(traces)))]
+        filled_layout = dict(self.layout)
+        for key, value in (layout or {}).items():
+            if isinstance(value, dict) and isinstance(filled_layout.get(key), dict):
+                value = dict(filled_layout[key], **value)
+            filled_layout[key] = value
+        return {'data': data, 'layout': filled_layout}
+
+    # subplot title annotations of the skeleton with new texts
+    def annotations(self, texts):
+        return [dict(annotation, text=text) for annotation, text in zip(self.layout.get('annotations', []), texts)]
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sys
+
+import numpy as np
+
+import dataset_cache
+
+# Preprocessing of datasets/countries.geojson into the geometry asset of the choropleth map
+# Only the countries of the rankings are kept, their polygons are simplified and their coordinates quantized,
+# and the result is served once as a static file instead of being embedded in every map figure
+
+source_path = 'datasets/countries.geojson'
+asset_path = 'assets/countries.geojson'
+# countries the asset was last built for, so checking it does not need to parse the source
+asset_meta_path = os.path.join(dataset_cache.cache_dir, 'countries-asset.json')
+feature_id = 'name_en'
+
+# Douglas-Peucker tolerance and number of decimals kept, in degrees (0.01 degree is about 1 km)
+default_tolerance = 0.05
+default_precision = 2
+
+
+# Douglas-Peucker simplification of a ring, returns the mask of the points that are kept
+def simplify_mask(points, tolerance):
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        # distances of all the points in between to the segment, computed at once
+        segment = points[end] - points[start]
+        offsets = points[start + 1:end] - points[start]
+        length = np.hypot(segment[0], segment[1])
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            index += start + 1
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return keep
+
+
+# Simplified and quantized ring, or None if it collapses
+def simplify_ring(ring, tolerance, precision):
+    points = np.asarray(ring, dtype=float)[:, :2]
+    points = np.round(points[simplify_mask(points, tolerance)], precision)
+
+    # drop the consecutive points that became equal after quantization
+    if len(points) > 1:
+        points = points[np.concatenate([[True], np.any(points[1:] != points[:-1], axis=1)])]
+    if len(points) < 4:
+        return None
+    return points.tolist()
+
+
+def simplify_polygon(polygon, tolerance, precision):
+    rings = [simplify_ring(ring, tolerance, precision) for ring in polygon]
+    if rings[0] is None:
+        return None
+    return [ring for ring in rings if ring is not None]
+
+
+def simplify_feature(feature, tolerance, precision):
+    geometry = feature['geometry']
+    polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+    simplified = [polygon for polygon in (simplify_polygon(polygon, tolerance, precision) for polygon in polygons) if polygon is not None]
+
+    # small countries keep their largest polygon at full detail instead of disappearing from the map
+    if not simplified:
+        largest = max(polygons, key=lambda polygon: len(polygon[0]))
+        simplified = [[np.round(np.asarray(ring, dtype=float)[:, :2], precision).tolist() for ring in largest]]
+
+    return {
+        'type': 'Feature',
+        'properties': {feature_id: feature['properties'][feature_id]},
+        'geometry': {'type': 'MultiPolygon', 'coordinates': simplified} if len(simplified) > 1 else {'type': 'Polygon', 'coordinates': simplified[0]},
+    }
+
+
+def simplify_countries(countries, country_names, tolerance=default_tolerance, precision=default_precision):
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            simplify_feature(feature, tolerance, precision)
+            for feature in countries['features']
+            if feature['properties'][feature_id] in country_names
+        ],
+    }
+
+
+def dump_geojson(countries):
+    return json.dumps(countries, separators=(',', ':'))
+
+
+# Builds the asset if it is missing, older than the source or was built for fewer countries
+def build_countries_asset(country_names, source=source_path, asset=asset_path, tolerance=default_tolerance, precision=default_precision):
+    country_names = set(country_names)
+    if os.path.exists(asset) and os.path.getmtime(asset) >= os.path.getmtime(source):
+        try:
+            with open(asset_meta_path) as f:
+                if country_names <= set(json.load(f)['country_names']):
+                    return asset
+        except (OSError, ValueError, KeyError):
+            pass
+
+    with open(source) as f:
+        countries = json.load(f)
+    try:
+        os.makedirs(os.path.dirname(asset), exist_ok=True)
+        with open(asset + '.tmp', 'w') as f:
+            f.write(dump_geojson(simplify_countries(countries, country_names, tolerance, precision)))
+        os.replace(asset + '.tmp', asset)
+    except OSError:
+        # a read-only deployment still works, with the committed asset
+        return asset
+
+    try:
+        os.makedirs(os.path.dirname(asset_meta_path), exist_ok=True)
+        with open(asset_meta_path, 'w') as f:
+            json.dump({'country_names': sorted(country_names)}, f)
+    except OSError:
+        pass
+    return asset
+
+
+# countries of the rankings in a datasets directory, with the rows of their further years (see ingest.py)
+def ranking_countries(directory):
+    import pandas as pd
+    from ingest import RankingSource, ranking_sources
+    return set(pd.concat([RankingSource(directory, name, read_options).load()['Country'] for name, read_options in ranking_sources]).dropna())
+
+
+# python geometry.py [tolerance] [precision]
+# rebuilds the asset and compares its size to the geometry that used to be embedded in every map figure
+if __name__ == '__main__':
+    import gzip
+
+    tolerance = float(sys.argv[1]) if len(sys.argv) > 1 else default_tolerance
+    precision = int(sys.argv[2]) if len(sys.argv) > 2 else default_precision
+    # the datasets directory of the app, see app.py
+    datasets_dir = os.environ.get('DATASETS_DIR', 'datasets')
+    source_path = os.path.join(datasets_dir, 'countries.geojson')
+
+    with open(source_path) as f:
+        countries = json.load(f)
+    before = dump_geojson(countries).encode()
+    after = dump_geojson(simplify_countries(countries, ranking_countries(datasets_dir), tolerance, precision)).encode()
+
+    os.makedirs(os.path.dirname(asset_path), exist_ok=True)
+    with open(asset_path, 'wb') as f:
+        f.write(after)
+
+    print('{:<32}{:>12}{:>12}'.format('', 'bytes', 'gzip bytes'))
+    print('{:<32}{:>12}{:>12}'.format(source_path, len(before), len(gzip.compress(before))))
+    print('{:<32}{:>12}{:>12}'.format(asset_path, len(after), len(gzip.compress(after))))
+    print('{:.1f}x smaller, {:.1f}x smaller compressed'.format(len(before) / len(after), len(gzip.compress(before)) / len(gzip.compress(after))))
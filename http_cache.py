@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import gzip
+import hashlib
+import threading
+
+import flask
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compressed and revalidated responses of the Flask server of the dashboard
+# Text and JSON responses of at least min_bytes, the callback responses included, are compressed with brotli (needs
+# the brotli package) or gzip, as the client accepts. The GET responses that are not streamed (page, layout, callback
+# graph, component bundles) carry an ETag of their content and encoding, and a client that sends it back in
+# If-None-Match gets a 304 without a body. Their compressed bodies are kept, so a bundle is only compressed once.
+# The Dash renderer cannot revalidate the POST of a callback, so the responses of the callbacks that only output
+# figures carry the content hash as their ETag, and the page sends back the ETag of the figures it shows with the
+# render stamp of its next request for them (see assets/dashboard.js). The server answers 204, which the renderer
+# takes as no update, when the new response is the same. The server keeps no state of the pages, so this holds
+# whichever worker answered the previous request.
+
+compressible_types = ('text/', 'application/json', 'application/javascript')
+
+
+# body of a response as sent with the given Content-Encoding
+def decompress(data, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(data)
+    if encoding == 'br':
+        return brotli.decompress(data)
+    return data
+
+
+def figure_outputs(output):
+    prop_ids = output.strip('.').split('...') if output.startswith('..') else [output]
+    return all(prop_id.rsplit('.', 1)[-1] == 'figure' for prop_id in prop_ids)
+
+
+class HttpCache:
+    def __init__(self, min_bytes=1024, level=6, max_bodies=64):
+        self.min_bytes = min_bytes
+        self.level = level
+        self.max_bodies = max_bodies
+        # ETag -> compressed body of a GET response, least recently used first
+        self.bodies = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.unchanged = 0
+        self.not_modified = 0
+        self.body_bytes = 0
+        self.wire_bytes = 0
+
+    def stats(self):
+        return {'unchanged': self.unchanged, 'not_modified': self.not_modified, 'body_bytes': self.body_bytes, 'wire_bytes': self.wire_bytes}
+
+    def encoding(self):
+        accepted = flask.request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def compress(self, data, encoding):
+        if encoding == 'br':
+            return brotli.compress(data, quality=min(self.level, 11))
+        # mtime=0 makes the bytes depend on the content only
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    # 204 for a figure callback whose response is the one the page shows
+    def skip_unchanged(self, response):
+        body = flask.request.get_json(silent=True) or {}
+        render, output = body.get('render'), body.get('output')
+        if not isinstance(render, dict) or not output or not figure_outputs(output):
+            return response
+
+        content_hash = hashlib.sha1(response.get_data()).hexdigest()
+        response.set_etag(content_hash)
+        if render.get('shown') != content_hash:
+            return response
+        with self.lock:
+            self.unchanged += 1
+
+        unchanged = flask.Response(status=204)
+        unchanged.set_etag(content_hash)
+        return unchanged
+
+    def after_request(self, response):
+        request = flask.request
+        if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+            return response
+
+        if request.method == 'POST' and request.path.endswith('_dash-update-component') and response.status_code == 200:
+            response = self.skip_unchanged(response)
+        if response.status_code != 200:
+            return response
+
+        data = response.get_data()
+        compressible = self.level > 0 and response.mimetype.startswith(compressible_types) and len(data) >= self.min_bytes
+        encoding = self.encoding() if compressible else None
+        if compressible:
+            response.vary.add('Accept-Encoding')
+
+        etag = None
+        if request.method == 'GET':
+            etag, weak = response.get_etag()
+            if etag is None:
+                etag, weak = hashlib.sha1(data).hexdigest(), False
+            # a strong ETag differs between the encodings of a body
+            if encoding is not None:
+                etag = '{}-{}'.format(etag, encoding)
+            response.set_etag(etag, weak)
+            response.make_conditional(request)
+            if response.status_code == 304:
+                with self.lock:
+                    self.not_modified += 1
+                return response
+
+        compressed = data
+        if encoding is not None:
+            with self.lock:
+                compressed = self.bodies.get(etag) if etag is not None else None
+                if compressed is not None:
+                    self.bodies.move_to_end(etag)
+            if compressed is None:
+                compressed = self.compress(data, encoding)
+                if etag is not None:
+                    with self.lock:
+                        self.bodies[etag] = compressed
+                        while len(self.bodies) > self.max_bodies:
+                            self.bodies.popitem(last=False)
+            response.set_data(compressed)
+            response.headers['Content-Encoding'] = encoding
+
+        with self.lock:
+            self.body_bytes += len(data)
+            self.wire_bytes += len(compressed)
+        return response
+
+    def register(self, server):
+        server.after_request(self.after_request)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import dataset_cache
+from store import compact_dtypes, widen_floats
+
+# Incremental ingest of the ranking CSVs
+# A ranking is read from its CSV, e.g. datasets/times.csv, and from CSVs with the rows of further years next to it,
+# e.g. datasets/times-2023.csv. The ingest remembers how far it parsed every file, so a refresh only parses the
+# rows appended to a file and the files that are new. A ranking with a file that was rewritten or removed is read
+# again as a whole. The rankings are kept with the compact dtypes of store.compact_dtypes.
+
+logger = logging.getLogger(__name__)
+
+# bytes before the parsed offset of a file that are compared to tell an append from a rewrite
+tail_size = 4096
+
+# (name, pd.read_csv options) of every ranking, in the order of the Rankings of the app
+ranking_sources = [('times', {}), ('shanghai', {'encoding': 'cp1252'}), ('cwur', {})]
+
+
+def read_tail(f, offset):
+    start = max(offset - tail_size, 0)
+    f.seek(start)
+    return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+
+# Parsed state of a single CSV
+class SourceFile:
+    def __init__(self, path, read_options):
+        self.path = path
+        self.read_options = read_options
+        self.header = b''
+        self.offset = 0
+        self.tail = None
+
+    # parses the whole file
+    def read(self):
+        df = dataset_cache.read_csv(self.path, **self.read_options)
+        with open(self.path, 'rb') as f:
+            self.header = f.readline()
+            self.offset = os.fstat(f.fileno()).st_size
+            self.tail = read_tail(f, self.offset)
+        return df
+
+    # rows appended since the last read, an empty DataFrame if there are none, None if the file was rewritten
+    def read_appended(self):
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return None
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if size < self.offset or f.readline() != self.header or read_tail(f, self.offset) != self.tail:
+                return None
+            if size == self.offset:
+                return pd.DataFrame()
+
+            # only complete lines are parsed, a row that is still being written is left for the next refresh
+            f.seek(self.offset)
+            appended = f.read(size - self.offset)
+            appended = appended[:appended.rfind(b'\n') + 1]
+            if not appended:
+                return pd.DataFrame()
+
+            df = pd.read_csv(io.BytesIO(self.header + appended), **self.read_options)
+            self.offset += len(appended)
+            self.tail = read_tail(f, self.offset)
+            return df
+
+
+# rows with compact dtypes whose float32 scores are widened back to the decimals of the CSV, so that they
+# concatenate with freshly parsed float64 rows into columns that compact_dtypes narrows again
+def widened_floats(df):
+    return df.assign(**{name: widen_floats(df[name].to_numpy()) for name in df.columns if df[name].dtype == np.float32})
+
+
+class RankingSource:
+    def __init__(self, directory, name, read_options):
+        self.directory = directory
+        self.name = name
+        self.read_options = read_options
+        self.files = {}
+        self.df = None
+
+    # the CSV of the ranking followed by its CSVs of further years, e.g. times-2023.csv
+    def paths(self):
+        year_paths = glob.glob(os.path.join(glob.escape(self.directory), '{}-*.csv'.format(glob.escape(self.name))))
+        pattern = re.compile(r'{}-\d{{4}}\.csv'.format(re.escape(self.name)))
+        return [os.path.join(self.directory, '{}.csv'.format(self.name))] + sorted(path for path in year_paths if pattern.fullmatch(os.path.basename(path)))
+
+    # identity of the parsed rows: name, parsed size and tail of every file, the same across restarts
+    def version(self):
+        sha1 = hashlib.sha1()
+        for path, source_file in self.files.items():
+            sha1.update('{}:{}:{};'.format(os.path.basename(path), source_file.offset, source_file.tail).encode())
+        return sha1.hexdigest()[:16]
+
+    def load(self):
+        self.files = {path: SourceFile(path, self.read_options) for path in self.paths()}
+        self.df = compact_dtypes(pd.concat([source_file.read() for source_file in self.files.values()], ignore_index=True))
+        return self.df
+
+    # returns whether the ranking has new rows
+    def refresh(self):
+        paths = self.paths()
+        if any(path not in paths for path in self.files):
+            self.load()
+            return True
+
+        parts = []
+        for path in paths:
+            source_file = self.files.get(path)
+            if source_file is None:
+                source_file = self.files[path] = SourceFile(path, self.read_options)
+                parts.append(source_file.read())
+                continue
+            appended = source_file.read_appended()
+            if appended is None:
+                self.load()
+                return True
+            if not appended.empty:
+                parts.append(appended)
+
+        if not parts:
+            return False
+        self.df = compact_dtypes(pd.concat([widened_floats(self.df)] + parts, ignore_index=True))
+        return True
+
+
+class RankingIngest:
+    def __init__(self, directory, sources):
+        self.sources = [RankingSource(directory, name, read_options) for name, read_options in sources]
+        # version of the rows of every ranking, see RankingSource.version
+        self.versions = [None] * len(self.sources)
+        self.lock = threading.Lock()
+        # id of the process whose thread watches the datasets, see watch_process
+        self.watching = None
+        self.watch_lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            dataframes = [source.load() for source in self.sources]
+            self.versions = [source.version() for source in self.sources]
+            return dataframes
+
+    def paths(self):
+        return [path for source in self.sources for path in source.files]
+
+    def dataframes(self):
+        return [source.df for source in self.sources]
+
+    # returns the indexes of the rankings that changed
+    def refresh(self):
+        with self.lock:
+            changed = [index for index, source in enumerate(self.sources) if source.refresh()]
+            for index in changed:
+                self.versions[index] = self.sources[index].version()
+            return changed
+
+    # refreshes every `interval` seconds in a background thread and calls on_change with the changed rankings
+    def watch(self, interval, on_change):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    changed = self.refresh()
+                    if changed:
+                        on_change(changed)
+                except Exception:
+                    logger.exception('Refreshing the rankings failed')
+
+        thread = threading.Thread(target=run, name='ranking-ingest', daemon=True)
+        thread.start()
+        return thread
+
+    # starts watching in the calling process unless it already does: threads do not survive a fork, so every
+    # worker forked from a preloaded server (gunicorn --preload) needs a thread of its own
+    def watch_process(self, interval, on_change):
+        if self.watching == os.getpid():
+            return
+        with self.watch_lock:
+            if self.watching != os.getpid():
+                self.watch(interval, on_change)
+                self.watching = os.getpid()
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import random
+import re
+import threading
+import time
+
+import flask
+from dash import ctx
+from dash.exceptions import PreventUpdate
+
+# Instrumentation of the callbacks and chart builders of a Dash app
+# Latencies, output sizes and triggers are kept in memory per process and exposed in the Prometheus text format.
+# A callback is timed twice: its function body (data access and figure building) and the whole dispatch, which
+# also includes the JSON serialization of its outputs, so the serialization time is the difference of the two.
+# The size of every response is its serialized length. Measuring the size of every output means parsing the
+# response again, so it is only done for a sampled share of the dispatches.
+
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+size_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# time spent in the body of the callback being dispatched, set by Metrics.callback
+body_seconds = contextvars.ContextVar('body_seconds', default=None)
+
+
+def escape_label(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, escape_label(value)) for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [bucket counts, sum, count]
+        self.series = {}
+
+    def observe(self, label_values, value):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        for label_values, (counts, total, count) in sorted(self.series.items()):
+            labels = list(zip(self.label_names, label_values))
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append('{}_bucket{} {}'.format(self.name, format_labels(labels, [('le', format_value(bound))]), bucket_count))
+            lines.append('{}_bucket{} {}'.format(self.name, format_labels(labels, [('le', '+Inf')]), count))
+            lines.append('{}_sum{} {}'.format(self.name, format_labels(labels), format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, format_labels(labels), count))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.series = {}
+
+    def increment(self, label_values, amount=1):
+        self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        for label_values, value in sorted(self.series.items()):
+            lines.append('{}{} {}'.format(self.name, format_labels(zip(self.label_names, label_values)), format_value(value)))
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, documentation, func):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+
+    def render(self):
+        return [
+            '# HELP {} {}'.format(self.name, self.documentation),
+            '# TYPE {} gauge'.format(self.name),
+            '{} {}'.format(self.name, format_value(self.func())),
+        ]
+
+
+# Samples a share of the callback dispatches with cProfile and dumps the profile of those slower than slow_seconds
+class SlowRequestProfiler:
+    def __init__(self, sample_rate=0.0, slow_seconds=0.5, directory='.cache/profiles', max_profiles=100):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.dumped = 0
+
+    def start(self):
+        if self.sample_rate <= 0 or self.dumped >= self.max_profiles or random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already active
+            return None
+        return profile
+
+    # returns the path of the dumped profile, or None if the dispatch was fast enough
+    def stop(self, profile, name, elapsed):
+        profile.disable()
+        if elapsed < self.slow_seconds or self.dumped >= self.max_profiles:
+            return None
+        self.dumped += 1
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, '{}-{}-{}-{}.prof'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), self.dumped, re.sub(r'\W+', '-', name)))
+        profile.dump_stats(path)
+        return path
+
+
+class Metrics:
+    def __init__(self, profiler=None, output_sample_rate=0.05):
+        self.lock = threading.Lock()
+        self.profiler = profiler or SlowRequestProfiler()
+        self.output_sample_rate = output_sample_rate
+        self.callback_seconds = Histogram('dashboard_callback_seconds', 'Time spent in the callback functions', ('callback',), latency_buckets)
+        self.dispatch_seconds = Histogram('dashboard_callback_dispatch_seconds', 'Time spent dispatching the callbacks, including the serialization of their outputs', ('callback',), latency_buckets)
+        self.serialization_seconds = Histogram('dashboard_callback_serialization_seconds', 'Time spent serializing the outputs of the callbacks', ('callback',), latency_buckets)
+        self.response_bytes = Histogram('dashboard_callback_response_bytes', 'Serialized size of the callback responses', ('callback',), size_buckets)
+        self.output_bytes = Histogram('dashboard_callback_output_bytes', 'Serialized size of the callback outputs, in a sample of the responses', ('callback', 'output'), size_buckets)
+        self.builder_seconds = Histogram('dashboard_builder_seconds', 'Time spent in the chart and table builders, figure cache hits excluded', ('builder',), latency_buckets)
+        self.triggers = Counter('dashboard_callback_triggers_total', 'Callback calls by triggering component', ('callback', 'trigger'))
+        self.errors = Counter('dashboard_callback_errors_total', 'Callback calls that raised an exception other than PreventUpdate', ('callback',))
+        self.profiles = Counter('dashboard_profiles_total', 'Profiles dumped of slow callback dispatches', ('callback',))
+        self.gauges = []
+
+    def gauge(self, name, documentation, func):
+        self.gauges.append(Gauge(name, documentation, func))
+
+    # decorator for the body of a callback, placed under @app.callback
+    def callback(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                body_seconds.set(elapsed)
+                trigger = ctx.triggered_id
+                with self.lock:
+                    self.callback_seconds.observe((func.__name__,), elapsed)
+                    self.triggers.increment((func.__name__, 'none' if trigger is None else json.dumps(trigger) if isinstance(trigger, dict) else trigger))
+        return wrapper
+
+    # decorator for a builder, placed under @figure_cache.memoize so that only actual builds are timed
+    def builder(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    with self.lock:
+                        self.builder_seconds.observe((name,), elapsed)
+            return wrapper
+        return decorator
+
+    # wraps the dispatch of a registered callback, which returns the serialized response of its outputs
+    def instrument_dispatch(self, name, dispatch):
+        @functools.wraps(dispatch)
+        def wrapper(*args, **kwargs):
+            body_seconds.set(None)
+            profile = self.profiler.start()
+            start = time.perf_counter()
+            try:
+                response = dispatch(*args, **kwargs)
+            except PreventUpdate:
+                raise
+            except Exception:
+                with self.lock:
+                    self.errors.increment((name,))
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                if profile is not None and self.profiler.stop(profile, name, elapsed) is not None:
+                    with self.lock:
+                        self.profiles.increment((name,))
+
+            body = body_seconds.get()
+            sizes = []
+            if self.output_sample_rate > 0 and random.random() < self.output_sample_rate:
+                sizes = [
+                    ('{}.{}'.format(component_id, prop), len(json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode()))
+                    for component_id, props in json.loads(response).get('response', {}).items()
+                    for prop, value in props.items()
+                ]
+            with self.lock:
+                self.dispatch_seconds.observe((name,), elapsed)
+                if body is not None:
+                    self.serialization_seconds.observe((name,), max(elapsed - body, 0.0))
+                self.response_bytes.observe((name,), len(response.encode()))
+                for output, size in sizes:
+                    self.output_bytes.observe((name, output), size)
+            return response
+        return wrapper
+
+    # instruments every server-side callback registered so far and serves the metrics on the Flask server
+    def instrument_app(self, app, route='/metrics'):
+        for key, callback in app.callback_map.items():
+            if 'callback' in callback and not getattr(callback['callback'], 'instrumented', False):
+                callback['callback'] = self.instrument_dispatch(callback['callback'].__name__, callback['callback'])
+                callback['callback'].instrumented = True
+
+        app.server.add_url_rule(route, 'metrics', lambda: flask.Response(self.render(), mimetype='text/plain; version=0.0.4'))
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in (self.callback_seconds, self.dispatch_seconds, self.serialization_seconds, self.response_bytes, self.output_bytes,
+                           self.builder_seconds, self.triggers, self.errors, self.profiles):
+                lines.extend(metric.render())
+        for gauge in self.gauges:
+            lines.extend(gauge.render())
+        return '\n'.join(lines) + '\n'
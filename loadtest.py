@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+
+# End-to-end load test
+# Starts the dashboard on a local port with W preloaded worker processes of T threads each (like
+# gunicorn --preload -w W --threads T app:server) and replays user journeys from concurrent simulated browsers
+# against the Dash update endpoint: switching rankings, sweeping the year slider, selecting table rows, clicking
+# the map and opening the university overview. A simulated browser reads the layout and the callback graph from
+# the server and chains the callbacks like the Dash renderer: a callback runs once its inputs changed, after the
+# callbacks whose outputs it depends on. The clientside callbacks (ranking buttons, map clicks) are applied in
+# Python. Throughput, error rate and the p50/p95/p99 latency of every callback are reported for every
+# configuration and number of clients.
+#
+# python loadtest.py [--configs 1x1 1x4 2x4] [--clients 1 8 32] [--duration 30] [--output loadtest.json]
+# python loadtest.py --url http://127.0.0.1:8050 [--clients 8]     against a server that is already running
+
+import argparse
+import concurrent.futures
+import http.client
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+import numpy as np
+
+from http_cache import decompress
+
+# countries clicked on the map
+map_countries = ['United States of America', 'United Kingdom', 'Germany', 'Japan', 'China', 'France', 'Australia']
+
+
+# Server
+# The app is imported once and the workers are forked from it, every worker answers the connections it accepts
+# on the shared socket with a pool of threads
+def serve(port, workers, threads):
+    import logging
+
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+    import app as dashboard
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    class PooledWSGIServer(BaseWSGIServer):
+        multithread = True
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.process_request_thread, request, client_address)
+
+        def process_request_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    logging.basicConfig(level=logging.WARNING)
+    server = PooledWSGIServer('127.0.0.1', port, dashboard.server, handler=QuietRequestHandler)
+
+    children = []
+    for worker in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            server.pool = concurrent.futures.ThreadPoolExecutor(threads)
+            server.serve_forever()
+            os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# Starts a server process, returns it with its URL once it answers
+def start_server(workers, threads, log_file, timeout=300):
+    port = free_port()
+    env = dict(os.environ)
+    env.setdefault('DATASETS_WATCH_SECONDS', '0')
+    process = subprocess.Popen([sys.executable, __file__, '--serve', '--port', str(port), '--workers', str(workers), '--threads', str(threads)],
+                               env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    url = 'http://127.0.0.1:{}'.format(port)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('the server exited with status {}, see {}'.format(process.returncode, log_file.name))
+        try:
+            status, _, _, _ = request(url, 'GET', '/_dash-layout')
+            if status == 200:
+                return process, url
+        except OSError:
+            pass
+        time.sleep(0.5)
+    stop_server(process)
+    raise RuntimeError('the server did not answer within {} s, see {}'.format(timeout, log_file.name))
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+# HTTP
+# one connection per request: a kept-alive connection would hold a thread of the worker between requests
+# (status, decompressed body, bytes received, ETag) of a request that accepts gzipped responses like a browser
+def request(url, method, path, body=None, timeout=60):
+    parts = urllib.parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    try:
+        headers = {'Connection': 'close', 'Accept-Encoding': 'gzip'}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+        etag = response.getheader('ETag')
+        return response.status, decompress(data, response.getheader('Content-Encoding')), len(data), etag.strip('"') if etag else None
+    finally:
+        connection.close()
+
+
+# Callback Graph
+def prop_ids(output):
+    if output.startswith('..'):
+        return output.strip('.').split('...')
+    return [output]
+
+
+def parse_callbacks(dependencies):
+    callbacks = []
+    for dependency in dependencies:
+        # the clientside callbacks run in the browser, the journeys apply their outputs themselves
+        if dependency.get('clientside_function'):
+            continue
+        callbacks.append({
+            'output': dependency['output'],
+            'name': prop_ids(dependency['output'])[0],
+            'outputs': prop_ids(dependency['output']),
+            'inputs': dependency['inputs'],
+            'state': dependency['state'],
+            'input_ids': {'{}.{}'.format(item['id'], item['property']) for item in dependency['inputs']},
+            'initial': not dependency.get('prevent_initial_call'),
+        })
+    return callbacks
+
+
+# property values of the components of the layout, by 'id.property'
+def layout_props(layout, session=None):
+    session = {} if session is None else session
+    if isinstance(layout, list):
+        for child in layout:
+            layout_props(child, session)
+    elif isinstance(layout, dict) and 'props' in layout:
+        props = layout['props']
+        for prop, value in props.items():
+            if 'id' in props and isinstance(props['id'], str) and prop != 'id':
+                session['{}.{}'.format(props['id'], prop)] = value
+            if isinstance(value, (list, dict)):
+                layout_props(value, session)
+    return session
+
+
+# Callbacks to run after `callbacks` are triggered, including those triggered by their outputs, ordered so that
+# every callback runs after the callbacks whose outputs it depends on
+def callback_chain(all_callbacks, callbacks):
+    chain = list(callbacks)
+    pending = list(callbacks)
+    while pending:
+        callback = pending.pop()
+        for other in all_callbacks:
+            if other not in chain and other is not callback and other['input_ids'] & set(callback['outputs']):
+                chain.append(other)
+                pending.append(other)
+
+    ordered = []
+    while chain:
+        ready = [callback for callback in chain if not any(
+            other is not callback and callback['input_ids'] & set(other['outputs']) for other in chain)]
+        # a cycle is broken in the order of the layout
+        callback = ready[0] if ready else chain[0]
+        ordered.append(callback)
+        chain.remove(callback)
+    return ordered
+
+
+# Simulated Browser
+class Browser:
+    def __init__(self, url, layout, callbacks, records, seed):
+        self.url = url
+        self.layout = layout
+        self.callbacks = callbacks
+        self.records = records
+        self.rng = random.Random(seed)
+        self.session = {}
+        # requests are stamped like those of assets/dashboard.js, see render_versions.py; every browser is a new
+        # page, so the sequences of a run do not collide with those of an earlier run against the same server
+        self.page = 'loadtest-{}-{}'.format(seed, uuid.uuid4().hex)
+        self.sequence = 0
+        # callback output -> ETag of the figures the browser shows, see http_cache.py
+        self.shown = {}
+
+    def call(self, callback, changed):
+        def dependencies(items):
+            return [dict(item, value=self.session.get('{}.{}'.format(item['id'], item['property']))) for item in items]
+
+        outputs = [{'id': prop_id.rsplit('.', 1)[0], 'property': prop_id.rsplit('.', 1)[1]} for prop_id in callback['outputs']]
+        self.sequence += 1
+        payload = {
+            'output': callback['output'],
+            'outputs': outputs if callback['output'].startswith('..') else outputs[0],
+            'inputs': dependencies(callback['inputs']),
+            'state': dependencies(callback['state']),
+            'changedPropIds': sorted(changed),
+            'render': {'page': self.page, 'sequence': self.sequence},
+        }
+        if callback['output'] in self.shown:
+            payload['render']['shown'] = self.shown[callback['output']]
+
+        start = time.perf_counter()
+        try:
+            status, body, wire_bytes, etag = request(self.url, 'POST', '/_dash-update-component', payload)
+        except OSError as e:
+            status, body, wire_bytes, etag = None, str(e).encode(), 0, None
+        self.records.append({'callback': callback['name'], 'status': status, 'ms': (time.perf_counter() - start) * 1000, 'bytes': len(body), 'wire_bytes': wire_bytes, 'start': start})
+
+        updated = set()
+        if status == 200:
+            self.shown[callback['output']] = etag
+            for component_id, props in json.loads(body)['response'].items():
+                for prop, value in props.items():
+                    # partial updates are not applied, the simulated session keeps the previous value
+                    if not (isinstance(value, dict) and '__dash_patch_update' in value):
+                        self.session['{}.{}'.format(component_id, prop)] = value
+                    updated.add('{}.{}'.format(component_id, prop))
+        return updated
+
+    # runs the callbacks triggered by the changed properties and by the outputs they update, each one once
+    def run_chain(self, callbacks, changed, initial=False):
+        changed = set(changed)
+        for callback in callback_chain(self.callbacks, callbacks):
+            triggers = callback['input_ids'] & changed
+            if triggers or initial and callback['initial']:
+                changed |= self.call(callback, triggers)
+
+    def load(self):
+        self.session = layout_props(self.layout)
+        self.run_chain([callback for callback in self.callbacks if callback['initial']], (), initial=True)
+
+    # a user action: sets properties in the browser, then runs the callbacks they trigger
+    def change(self, changes):
+        self.session.update(changes)
+        self.run_chain([callback for callback in self.callbacks if callback['input_ids'] & set(changes)], changes)
+
+
+# Journeys
+# functions of a browser with a loaded page, `think` seconds between two user actions
+def switch_ranking(browser, think):
+    for rankings in browser.rng.sample(range(3), 3):
+        # selectRankings of assets/dashboard.js
+        browser.change({'main-rankings.data': rankings})
+        time.sleep(think)
+
+
+def sweep_slider(browser, think):
+    years = range(browser.session.get('main-slider.min', 2012), browser.session.get('main-slider.max', 2015) + 1)
+    for year in list(years)[::browser.rng.choice([1, -1])]:
+        browser.change({'main-slider.value': year})
+        time.sleep(think)
+
+
+def select_rows(browser, think):
+    for count in range(1, browser.rng.randint(2, 5)):
+        browser.change({'university-table.selected_rows': list(range(count))})
+        time.sleep(think)
+    browser.change({'university-table.selected_rows': []})
+
+
+def click_map(browser, think):
+    # filterMapCountry of assets/dashboard.js, with an empty filter or one on the country only
+    browser.change({'university-table.filter_query': '{{Country}} ="{}"'.format(browser.rng.choice(map_countries)), 'choropleth_map.clickData': None})
+    time.sleep(think)
+    browser.change({'university-table.filter_query': ''})
+
+
+def open_university(browser, think):
+    rows = browser.session.get('university-table.data') or []
+    if not rows:
+        return
+    browser.change({'university-table.active_cell': {'row': browser.rng.randrange(len(rows)), 'column': 1}})
+    time.sleep(think)
+    for year in browser.rng.sample(range(browser.session.get('university-year-slider.min', 2012), browser.session.get('university-year-slider.max', 2015) + 1), 3):
+        browser.change({'university-year-slider.value': year})
+        time.sleep(think)
+    for rankings in (1, 2, 0):
+        # selectRankings of the buttons of the overview
+        browser.change({'university-rankings.data': rankings})
+        time.sleep(think)
+    # the modal is closed in the browser, without a callback
+    browser.session['university-modal.is_open'] = False
+
+
+journeys = {
+    'switch ranking': switch_ranking,
+    'sweep slider': sweep_slider,
+    'select rows': select_rows,
+    'click map': click_map,
+    'open university': open_university,
+}
+
+
+# Load
+# `clients` browsers load the page and replay random journeys for `duration` seconds, the requests of the first
+# `ramp_up` seconds are left out of the statistics
+def run_load(url, clients, duration, ramp_up, think, seed):
+    status, layout, _, _ = request(url, 'GET', '/_dash-layout')
+    status, dependencies, _, _ = request(url, 'GET', '/_dash-dependencies')
+    layout, callbacks = json.loads(layout), parse_callbacks(json.loads(dependencies))
+
+    records = []
+    start = time.perf_counter()
+    deadline = start + ramp_up + duration
+
+    def run_browser(index):
+        browser = Browser(url, layout, callbacks, records, seed * 1000 + index)
+        browser.load()
+        while time.perf_counter() < deadline:
+            journeys[browser.rng.choice(sorted(journeys))](browser, think)
+            time.sleep(think)
+
+    threads = [threading.Thread(target=run_browser, args=(index,), daemon=True) for index in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    measured = [record for record in records if record['start'] >= start + ramp_up]
+    elapsed = max(time.perf_counter() - start - ramp_up, 1e-9)
+    return summarize(measured, elapsed)
+
+
+def is_error(record):
+    return record['status'] is None or record['status'] >= 400
+
+
+def summarize(records, elapsed):
+    def latencies(items):
+        values = np.array([record['ms'] for record in items]) if items else np.zeros(1)
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {
+            'requests': len(items),
+            'errors': sum(is_error(record) for record in items),
+            'p50_ms': round(float(p50), 2),
+            'p95_ms': round(float(p95), 2),
+            'p99_ms': round(float(p99), 2),
+        }
+
+    callbacks = sorted({record['callback'] for record in records})
+    summary = latencies(records)
+    summary.update({
+        'seconds': round(elapsed, 2),
+        'throughput': round(len(records) / elapsed, 2),
+        'error_rate': round(summary['errors'] / max(len(records), 1), 4),
+        # figures the page already had, answered with a 204
+        'unchanged': sum(record['status'] == 204 for record in records),
+        'bytes': sum(record['bytes'] for record in records),
+        'wire_bytes': sum(record['wire_bytes'] for record in records),
+        'callbacks': {callback: latencies([record for record in records if record['callback'] == callback]) for callback in callbacks},
+    })
+    return summary
+
+
+def print_results(results):
+    print('{:>8} {:>8} {:>10} {:>8} {:>9} {:>9} {:>9} {:>10} {:>10}'.format('config', 'clients', 'req/s', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'KB', 'wire KB'))
+    for result in results:
+        print('{:>8} {:>8} {:>10.1f} {:>7.2%} {:>9.1f} {:>9.1f} {:>9.1f} {:>10.0f} {:>10.0f}'.format(
+            result['config'], result['clients'], result['throughput'], result['error_rate'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            result['bytes'] / 1024, result['wire_bytes'] / 1024))
+        for callback, stats in result['callbacks'].items():
+            print('{:>8} {:>8}   {:<36} {:>6} req {:>5} err {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                '', '', callback, stats['requests'], stats['errors'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms']))
+
+
+def parse_config(config):
+    workers, _, threads = config.partition('x')
+    return int(workers), int(threads or 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the dashboard callbacks with concurrent simulated browsers')
+    parser.add_argument('--configs', nargs='+', default=['1x1', '1x4', '2x4'], help='server configurations, as <workers>x<threads>')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32], help='numbers of concurrent browsers')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds of every run')
+    parser.add_argument('--ramp-up', type=float, default=5, help='seconds of every run before the measurement')
+    parser.add_argument('--think', type=float, default=0, help='seconds between two actions of a browser')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the journeys')
+    parser.add_argument('--url', help='load test this running server instead of starting one per configuration')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workers', type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument('--threads', type=int, default=1, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.workers, args.threads)
+        sys.exit(0)
+
+    results = []
+    for config in ([args.url] if args.url else args.configs):
+        process = None
+        if args.url:
+            url = args.url
+        else:
+            log_file = tempfile.NamedTemporaryFile('w', prefix='loadtest-server-', suffix='.log', delete=False)
+            process, url = start_server(*parse_config(config), log_file)
+        try:
+            for clients in args.clients:
+                result = run_load(url, clients, args.duration, args.ramp_up, args.think, args.seed)
+                result.update({'config': config if not args.url else 'url', 'clients': clients})
+                results.append(result)
+                print('{} with {} clients: {:.1f} req/s, p95 {:.1f} ms, {:.2%} errors'.format(result['config'], clients, result['throughput'], result['p95_ms'], result['error_rate']), file=sys.stderr)
+        finally:
+            if process is not None:
+                stop_server(process)
+
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+# Memory footprint of the dashboard processes
+# With a preloaded server (gunicorn --preload app:server) the workers are forked after the rankings are loaded and
+# share their pages copy-on-write: the private memory of a worker is what it copied or allocated itself, the
+# shared memory is what it still reads from the preloading process.
+#
+# python memory.py [--workers 4]
+
+import argparse
+import json
+import os
+import sys
+
+import pandas as pd
+
+from store import display_frame
+
+
+# Rss, Pss, shared and private memory of the current process in bytes, Linux only
+def process_memory():
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+    except OSError:
+        return None
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'shared': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+        'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def frame_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+# DataFrames held by a RankingStore: the rankings, their year partitions and their histories sorted by year
+def store_frames(store):
+    for df in store.rankings_df:
+        yield df
+    for partitions in store.partitions:
+        yield from partitions.values()
+    yield from store.history_frames
+
+
+def store_bytes(store):
+    return sum(frame_bytes(df) for df in store_frames(store))
+
+
+# what the frames of the store would take with the default dtypes of pandas.read_csv
+def plain_store_bytes(store):
+    return sum(frame_bytes(display_frame(df).astype({name: 'int64' for name in df.columns if pd.api.types.is_integer_dtype(df[name])})) for df in store_frames(store))
+
+
+def format_megabytes(value):
+    return '{:.1f} MB'.format(value / 1e6)
+
+
+# Forks workers that render every view of every ranking once and reports the memory of each one
+def report_workers(dashboard, workers):
+    print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format('worker', 'rss', 'pss', 'shared', 'private'))
+    for worker in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            for university_rankings in dashboard.Rankings:
+                for year in dashboard.store.years(university_rankings.value):
+                    dashboard.load_table_page(dashboard.store, university_rankings, year, 'World Rank', '', [], 0, 5)
+                    dashboard.load_choropleth_map.uncached(dashboard.store, university_rankings, year, dashboard.country_base_metrics[0])
+            memory = process_memory() or {}
+            os.write(write_fd, json.dumps(memory).encode())
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as f:
+            memory = json.loads(f.read())
+        os.waitpid(pid, 0)
+        print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format(worker, *(format_megabytes(memory.get(key, 0)) for key in ('rss', 'pss', 'shared', 'private'))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the memory footprint of the dashboard processes')
+    parser.add_argument('--workers', type=int, default=2, help='forked workers to report on')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATASETS_WATCH_SECONDS', '0')
+    import app as dashboard
+
+    compact, plain = store_bytes(dashboard.store), plain_store_bytes(dashboard.store)
+    print('rankings in the store: {} with compact dtypes, {} with default dtypes ({:.0%} saved)'.format(format_megabytes(compact), format_megabytes(plain), 1 - compact / plain))
+    memory = process_memory()
+    if memory is None:
+        print('per-process memory needs /proc/self/smaps_rollup')
+        sys.exit(0)
+    print('preloaded process: rss {}, private {}'.format(format_megabytes(memory['rss']), format_megabytes(memory['private'])))
+    report_workers(dashboard, args.workers)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from store import widen_floats
+
+# Year-over-year movers of a ranking
+# The universities listed in both years are aligned by their dense university code (see RankingStore) with a single
+# index lookup, and the changes of their rank, rank percentile and criteria are computed for all of them at once.
+# A positive change is always an improvement: a better rank or percentile, or a higher score.
+
+rank_metrics = ['World Rank', 'Percentile']
+
+
+# Percentile of the rank of every university in its year, 100 for the first one
+def rank_percentiles(df):
+    orders = df['World Rank Order'].to_numpy(dtype=float)
+    return 100 * (1 - (orders - 1) / max(len(df), 1))
+
+
+# scores as float64, float32 ones are kept as they are and only widened in the rows of the top movers
+def score_values(series):
+    if series.dtype == np.float32:
+        return series.to_numpy()
+    return pd.to_numeric(series, errors='coerce').to_numpy(dtype=float)
+
+
+# rows of the movers with their float32 scores widened to their decimal value (see store.widen_floats), and the
+# changes of those scores computed again from the widened ones, 0.1 instead of 0.10000038
+def widened_movers(movers_df):
+    columns = {}
+    for name in movers_df.columns:
+        values = movers_df[name]
+        columns[name] = widen_floats(values.to_numpy()) if values.dtype == np.float32 else values
+    for name in movers_df.columns:
+        if '{} From'.format(name) in movers_df.columns and movers_df['{} From'.format(name)].dtype == np.float32:
+            columns[name] = columns['{} To'.format(name)] - columns['{} From'.format(name)]
+    return pd.DataFrame(columns, index=movers_df.index)
+
+
+# position of the first row of every ID, -1 for the IDs that have none
+def first_positions(ids, size):
+    lookup = np.full(size, -1, dtype=np.int64)
+    lookup[ids[::-1]] = np.arange(len(ids) - 1, -1, -1)
+    return lookup
+
+
+# One row per university listed in both years, with '<metric> From', '<metric> To' and the change '<metric>'
+# for the rank, its percentile and every criterion
+# from_codes and to_codes are the university codes of the rows of both years
+def align_years(from_df, to_df, from_codes, to_codes, criteria):
+    # a university listed under two names in the same year counts once, with its first row
+    size = max(from_codes.max(initial=-1), to_codes.max(initial=-1)) + 1
+    positions = first_positions(from_codes, size)[to_codes]
+    matched = (positions >= 0) & (first_positions(to_codes, size)[to_codes] == np.arange(len(to_codes)))
+    positions = positions[matched]
+
+    def both(values_from, values_to):
+        return values_from[positions], values_to[matched]
+
+    # text columns keep their dtype, categorical in the store, and are only indexed
+    columns = {
+        'University': to_df['University'].array[matched],
+        'Country': to_df['Country'].array[matched],
+        'World Rank Label From': from_df['World Rank'].array[positions],
+        'World Rank Label To': to_df['World Rank'].array[matched],
+    }
+
+    rank_from, rank_to = both(from_df['World Rank Order'].to_numpy(dtype=float), to_df['World Rank Order'].to_numpy(dtype=float))
+    columns.update({'World Rank From': rank_from, 'World Rank To': rank_to, 'World Rank': rank_from - rank_to})
+
+    percentile_from, percentile_to = both(rank_percentiles(from_df), rank_percentiles(to_df))
+    columns.update({'Percentile From': percentile_from, 'Percentile To': percentile_to, 'Percentile': percentile_to - percentile_from})
+
+    for criterion in criteria:
+        value_from, value_to = both(score_values(from_df[criterion]), score_values(to_df[criterion]))
+        columns.update({'{} From'.format(criterion): value_from, '{} To'.format(criterion): value_to, criterion: value_to - value_from})
+
+    return pd.DataFrame(columns)
+
+
+# (risers, fallers): the `count` universities with the largest improvement and the largest decline of a metric,
+# optionally only those of a country, in the order of their change and then of their rows
+def top_movers(movers_df, metric, count, country=None):
+    if country:
+        movers_df = movers_df[(movers_df['Country'] == country).to_numpy()]
+    changes = movers_df[metric].to_numpy()
+    rising = np.flatnonzero(changes > 0)
+    falling = np.flatnonzero(changes < 0)
+
+    # a change of float32 scores is off the change of their decimals by less than 1e-5 of the scores, so every
+    # university within twice that of the last one selected is a candidate, and the selection is made once widened
+    tolerance = 0.0
+    if changes.dtype == np.float32 and len(changes):
+        tolerance = 1e-5 * np.nanmax(np.abs(movers_df[['{} From'.format(metric), '{} To'.format(metric)]].to_numpy()), initial=0)
+
+    def largest(positions, sign):
+        if len(positions) > count:
+            values = sign * changes[positions]
+            threshold = np.partition(values, len(values) - count)[len(values) - count]
+            positions = positions[values >= threshold - 2 * tolerance]
+        # equal changes keep the order of the rows
+        candidates_df = widened_movers(movers_df.take(positions))
+        return candidates_df.take(np.argsort(-sign * candidates_df[metric].to_numpy(), kind='stable')[:count])
+
+    return largest(rising, 1), largest(falling, -1)
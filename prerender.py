@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+# Static snapshot of the dashboard
+# Prerenders the main view of every ranking and year (map, full table, criteria and trend charts of its best
+# universities, movers since the previous year) and the overview of every university (line charts of every ranking
+# and radar chart of every year), and writes them as gzipped JSON files next to a navigation shell, prerender.html,
+# which draws them with plotly.js. The bundle is served by any static file server, without Python.
+# Views are rendered in parallel by worker processes forked after the rankings are loaded. The manifest of the
+# bundle keeps a fingerprint of the source rows of every view, so a later run only renders again the views whose
+# rows changed, e.g. after a new ranking year was added.
+#
+# python prerender.py [--output build] [--workers 4] [--force]
+
+import argparse
+import concurrent.futures
+import functools
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+
+import pandas as pd
+import plotly
+import plotly.graph_objects as go
+
+# changes when the content of the views changes, so that every view is rendered again
+prerender_version = 1
+
+# universities selected in the criteria and trend charts of a main view
+prerender_selection = 5
+
+shell_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prerender.html')
+manifest_name = 'manifest.json'
+
+
+# Fingerprints
+# sha1 of the prerender version, the parameters of a view and the hashes of the rows it is built from
+def fingerprint(parameters, row_hashes):
+    digest = hashlib.sha1(json.dumps([prerender_version, parameters]).encode())
+    for hashes in row_hashes:
+        digest.update(hashes.tobytes())
+    return digest.hexdigest()
+
+
+# hashes of the source rows, without their university IDs: the IDs a view links to are fingerprinted on their own
+def frame_row_hashes(df):
+    return pd.util.hash_pandas_object(df.drop(columns='University ID', errors='ignore'), index=False).to_numpy()
+
+
+# hashes of the rows of the histories of a ranking, computed once per worker, so that the fingerprint of a
+# university only indexes them
+@functools.lru_cache(maxsize=None)
+def history_row_hashes(store, ranking):
+    return frame_row_hashes(store.history_frames[ranking])
+
+
+def figure_json(fig):
+    return fig.to_plotly_json() if isinstance(fig, go.Figure) else fig
+
+
+def write_bytes(path, data):
+    # unchanged files keep their modification time, so static servers and browsers can keep them cached
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+    return True
+
+
+def write_json_gz(path, payload):
+    data = json.dumps(payload, cls=plotly.utils.PlotlyJSONEncoder, separators=(',', ':')).encode()
+    # mtime=0 makes the bytes depend on the content only
+    return write_bytes(path, gzip.compress(data, compresslevel=9, mtime=0))
+
+
+# Views
+def view_path(university_rankings, year):
+    return 'views/{}/{}.json.gz'.format(university_rankings.name, year)
+
+
+def university_path(university_id):
+    return 'universities/{}.json.gz'.format(university_id)
+
+
+# names of every university ID, in the order of the rankings
+def load_university_names(store):
+    names = {}
+    for ids in store.university_ids:
+        for name, university_id in ids.items():
+            names.setdefault(university_id, []).append(name)
+    return names
+
+
+def main_view_sources(dashboard, store, university_rankings, year):
+    partition_df = store.partition(university_rankings.value, year)
+    selection = partition_df.sort_values(by='World Rank Order', kind='stable')['University'][:prerender_selection].tolist()
+    from_years = [from_year for from_year in store.years(university_rankings.value) if from_year < year]
+    from_year = from_years[-1] if from_years else None
+    frames = [partition_df, store.histories(university_rankings.value, selection)]
+    if from_year is not None:
+        frames.append(store.partition(university_rankings.value, from_year))
+    return selection, from_year, frames
+
+
+def render_main_view(dashboard, store, university_rankings, year, selection, from_year):
+    criteria = store.year_columns(university_rankings.value, year)
+    columns = ['World Rank', 'University', 'Country', 'Overall Score'] + criteria
+    table_df = dashboard.display_frame(store.partition(university_rankings.value, year)[columns + ['University ID']])
+
+    choropleth_fig = figure_json(dashboard.load_choropleth_map.uncached(store, university_rankings, year, dashboard.country_base_metrics[0]))
+    # the geometry is copied into the bundle, next to the shell
+    choropleth_fig['data'][0]['geojson'] = dashboard.countries.lstrip('/')
+
+    if from_year is None:
+        movers_fig = dashboard.no_earlier_year_figure
+    else:
+        movers_fig = dashboard.load_movers_chart.uncached(store, university_rankings, from_year, year, 'World Rank', None)
+
+    return {
+        'ranking': university_rankings.name,
+        'title': dashboard.rankings_names[university_rankings.value],
+        'year': year,
+        'columns': columns,
+        'rows': table_df[columns].astype(object).where(table_df[columns].notna(), None).values.tolist(),
+        'ids': table_df['University ID'].tolist(),
+        'figures': {
+            'map': choropleth_fig,
+            'bar': figure_json(dashboard.load_main_bar_chart.uncached(store, tuple(selection), university_rankings, year)),
+            'line': figure_json(dashboard.load_main_line_chart.uncached(store, tuple(selection), university_rankings, year, dashboard.default_main_criterion)),
+            'movers': figure_json(movers_fig),
+        },
+    }
+
+
+def render_university(dashboard, store, university_id, university_name, histories):
+    years = sorted({int(year) for history_df in histories.values() for year in history_df['Year']})
+    return {
+        'id': university_id,
+        'name': university_name,
+        'lines': {
+            university_rankings.name: figure_json(dashboard.load_university_line_chart.uncached(store, university_rankings, university_name))
+            for university_rankings in dashboard.Rankings if not histories[university_rankings].empty
+        },
+        'radars': {year: figure_json(dashboard.load_university_radar_chart.uncached(store, university_name, year)) for year in years},
+    }
+
+
+# Renders a task in a worker unless its fingerprint is the one of the previous run, returns
+# (path, fingerprint, rendered)
+def render_task(task, output_dir, previous):
+    import app as dashboard
+    store = dashboard.store
+
+    if task[0] == 'view':
+        _, rankings_value, year = task
+        university_rankings = dashboard.Rankings(rankings_value)
+        path = view_path(university_rankings, year)
+        selection, from_year, frames = main_view_sources(dashboard, store, university_rankings, year)
+        # the table links to the universities by ID, which only changes when a university is merged with another one
+        view_fingerprint = fingerprint(list(task), [frame_row_hashes(df) for df in frames] + [frames[0]['University ID'].to_numpy(dtype='int64')])
+        if view_fingerprint == previous and os.path.exists(os.path.join(output_dir, path)):
+            return path, view_fingerprint, False
+        write_json_gz(os.path.join(output_dir, path), render_main_view(dashboard, store, university_rankings, year, selection, from_year))
+    else:
+        _, university_id, university_name = task
+        path = university_path(university_id)
+        view_fingerprint = fingerprint(list(task), [
+            history_row_hashes(store, university_rankings.value)[store.history_indices[university_rankings.value].get(store.university_id(university_rankings.value, university_name), [])]
+            for university_rankings in dashboard.Rankings
+        ])
+        if view_fingerprint == previous and os.path.exists(os.path.join(output_dir, path)):
+            return path, view_fingerprint, False
+        histories = {university_rankings: store.history(university_rankings.value, university_name) for university_rankings in dashboard.Rankings}
+        write_json_gz(os.path.join(output_dir, path), render_university(dashboard, store, university_id, university_name, histories))
+    return path, view_fingerprint, True
+
+
+def task_path(dashboard, task):
+    if task[0] == 'view':
+        return view_path(dashboard.Rankings(task[1]), task[2])
+    return university_path(task[1])
+
+
+# Bundle
+def load_tasks(dashboard, store):
+    for university_rankings in dashboard.Rankings:
+        for year in store.years(university_rankings.value):
+            yield 'view', university_rankings.value, year
+    for university_id, names in load_university_names(store).items():
+        yield 'university', university_id, names[0]
+
+
+def write_index(dashboard, store, output_dir):
+    index = {
+        'rankings': [
+            {'name': university_rankings.name, 'title': dashboard.rankings_names[university_rankings.value], 'years': store.years(university_rankings.value)}
+            for university_rankings in dashboard.Rankings
+        ],
+        'default': {'ranking': dashboard.default_main_rankings.name, 'year': dashboard.default_main_year},
+        'universities': sorted(({'id': university_id, 'name': names[0]} for university_id, names in load_university_names(store).items()), key=lambda university: university['name']),
+    }
+    write_json_gz(os.path.join(output_dir, 'index.json.gz'), index)
+
+    with open(shell_path, encoding='utf-8') as f:
+        shell = f.read()
+    write_bytes(os.path.join(output_dir, 'index.html'), shell.replace('{{stylesheet}}', dashboard.dbc.themes.BOOTSTRAP).encode('utf-8'))
+
+    plotly_js = os.path.join(os.path.dirname(plotly.__file__), 'package_data', 'plotly.min.js')
+    with open(plotly_js, 'rb') as f:
+        write_bytes(os.path.join(output_dir, 'plotly.min.js'), f.read())
+    with open(dashboard.countries.lstrip('/'), 'rb') as f:
+        write_bytes(os.path.join(output_dir, dashboard.countries.lstrip('/')), f.read())
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, manifest_name)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest.get('views', {}) if manifest.get('version') == prerender_version else {}
+
+
+# Renders the views of the bundle that changed and removes those that no longer exist, returns the counts of
+# rendered, unchanged and removed views
+def prerender(output_dir, workers=None, force=False):
+    import app as dashboard
+    store = dashboard.store
+
+    previous = {} if force else load_manifest(output_dir)
+    tasks = list(load_tasks(dashboard, store))
+    os.makedirs(output_dir, exist_ok=True)
+    write_index(dashboard, store, output_dir)
+
+    def arguments(task):
+        return task, output_dir, previous.get(task_path(dashboard, task))
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+    else:
+        executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    views = {}
+    rendered = 0
+    with executor:
+        results = executor.map(render_task, *zip(*map(arguments, tasks)), chunksize=32)
+        for path, view_fingerprint, written in results:
+            views[path] = view_fingerprint
+            rendered += written
+
+    removed = 0
+    for path in set(previous) - set(views):
+        if os.path.exists(os.path.join(output_dir, path)):
+            os.remove(os.path.join(output_dir, path))
+            removed += 1
+
+    with open(os.path.join(output_dir, manifest_name), 'w') as f:
+        json.dump({'version': prerender_version, 'views': views}, f, indent=0, sort_keys=True)
+    return rendered, len(views) - rendered, removed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prerender the dashboard into a static bundle')
+    parser.add_argument('--output', default='build', help='directory of the bundle')
+    parser.add_argument('--workers', type=int, help='rendering processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='render every view again, even if its rows did not change')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATASETS_WATCH_SECONDS', '0')
+    start = time.perf_counter()
+    rendered, unchanged, removed = prerender(args.output, args.workers, args.force)
+    print('{} views rendered, {} unchanged, {} removed in {:.1f} s, serve {} with any static file server'.format(rendered, unchanged, removed, time.perf_counter() - start, args.output))
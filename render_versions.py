@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import contextvars
+import functools
+import threading
+
+import flask
+from dash.exceptions import PreventUpdate
+
+# Request versioning of the callbacks
+# The renderer stamps every callback request with the id of its page and a sequence number that grows with every
+# request of the page (see assets/dashboard.js). When a newer request of the same page for the same outputs has
+# reached the server, e.g. because the slider moved again, the older one is stale: the browser will only show the
+# newer one. A stale request is answered with PreventUpdate as soon as it starts, and a request that became stale
+# while it runs stops at its next checkpoint, before building another figure.
+# The latest sequences are kept per process, so with several workers only the requests of a page that reach the
+# same worker are coalesced.
+
+# (page, output, sequence) of the request being dispatched
+current_render = contextvars.ContextVar('current_render', default=None)
+
+
+class RenderVersions:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        # (page, output) -> sequence of its latest request, least recently used first
+        self.latest = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.skipped = 0
+
+    # records a request, returns False if a newer one of the same page for the same outputs arrived first
+    def begin(self, page, output, sequence):
+        key = (page, output)
+        with self.lock:
+            latest = self.latest.get(key)
+            if latest is not None and latest > sequence:
+                self.skipped += 1
+                return False
+            self.latest[key] = sequence
+            self.latest.move_to_end(key)
+            while len(self.latest) > self.max_entries:
+                self.latest.popitem(last=False)
+            return True
+
+    def is_stale(self):
+        render = current_render.get()
+        if render is None:
+            return False
+        page, output, sequence = render
+        with self.lock:
+            return self.latest.get((page, output), sequence) > sequence
+
+    # stops the request being dispatched if it is stale
+    def check(self):
+        if self.is_stale():
+            with self.lock:
+                self.skipped += 1
+            raise PreventUpdate
+
+    # decorator for a builder, placed under @figure_cache.memoize so that cached figures are still returned
+    def checkpoint(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self.check()
+            return func(*args, **kwargs)
+        return wrapper
+
+    # wraps the dispatch of a registered callback
+    def versioned_dispatch(self, dispatch):
+        @functools.wraps(dispatch)
+        def wrapper(*args, **kwargs):
+            body = flask.request.get_json(silent=True) or {}
+            render = body.get('render')
+            if not isinstance(render, dict) or 'page' not in render or 'sequence' not in render:
+                current_render.set(None)
+                return dispatch(*args, **kwargs)
+
+            page, output, sequence = str(render['page']), body.get('output'), int(render['sequence'])
+            if not self.begin(page, output, sequence):
+                raise PreventUpdate
+            current_render.set((page, output, sequence))
+            try:
+                return dispatch(*args, **kwargs)
+            finally:
+                current_render.set(None)
+        return wrapper
+
+    # versions every server-side callback registered so far, and has the renderer stamp its requests
+    def instrument_app(self, app):
+        for key, callback in app.callback_map.items():
+            if 'callback' in callback and not getattr(callback['callback'], 'versioned', False):
+                callback['callback'] = self.versioned_dispatch(callback['callback'])
+                callback['callback'].versioned = True
+
+        app.renderer = 'var renderer = new DashRenderer({request_pre: function (payload) { if (window.dashboardRender) { window.dashboardRender.stamp(payload); } }});'
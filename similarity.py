@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# Similar universities of a ranking
+# The criteria of every (ranking, year) partition are standardized once into a float32 matrix, with the missing
+# values set to 0 and a mask of the present ones. The distances of a university to all the others are then a few
+# matrix products: only the criteria both universities have are compared, and their sum is scaled up to all the
+# criteria (like a nan-euclidean distance), so a university is not closer to another just because it misses
+# criteria. Universities that share less than min_shared_fraction of the criteria of the university are left out.
+
+min_shared_fraction = 0.5
+
+
+class CriteriaMatrix:
+    def __init__(self, values):
+        values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+        present = ~np.isnan(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            counts = present.sum(axis=0)
+            mean = np.where(counts > 0, np.nansum(values, axis=0) / np.maximum(counts, 1), 0)
+            std = np.sqrt(np.where(counts > 0, np.nansum((values - mean) ** 2, axis=0) / np.maximum(counts, 1), 0))
+        std[std == 0] = 1
+
+        self.values = np.where(present, (values - mean) / std, 0).astype(np.float32)
+        self.squares = self.values ** 2
+        self.present = present.astype(np.float32)
+
+    def __len__(self):
+        return len(self.values)
+
+    # distances of the rows at `positions` to every row, one row of distances per position, inf where they share
+    # too few criteria
+    def distances(self, positions):
+        values, present = self.values[positions], self.present[positions]
+        shared = present @ self.present.T
+        # sum over the shared criteria of (a - b)^2 = a^2 - 2ab + b^2, the missing values are 0
+        squared = present @ self.squares.T - 2 * values @ self.values.T + (values ** 2) @ self.present.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            distances = np.sqrt(np.maximum(squared, 0) * self.present.shape[1] / shared)
+        distances[shared < np.maximum(1, min_shared_fraction * present.sum(axis=1, keepdims=True))] = np.inf
+        return distances
+
+
+# (positions, distances) of the `count` rows closest to the row at `position`, closest first, without the rows of
+# the same university ID (a university can be listed twice under two names)
+def nearest_rows(matrix, ids, position, count):
+    distances = matrix.distances([position])[0]
+    distances[ids == ids[position]] = np.inf
+    candidates = np.flatnonzero(np.isfinite(distances))
+    if len(candidates) > count:
+        candidates = candidates[np.argpartition(distances[candidates], count - 1)[:count]]
+    candidates = candidates[np.argsort(distances[candidates], kind='stable')]
+    return candidates, distances[candidates]
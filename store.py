@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from similarity import CriteriaMatrix, nearest_rows
+
+
+# metrics of the country cube that every ranking has, the mean of each criterion follows them
+country_base_metrics = ['Universities', 'Mean Overall Score', 'Median Overall Score', 'Best World Rank']
+
+# decimal digits that float32 keeps exactly, the scores are stored as float32 when they have no more
+float32_digits = 6
+
+
+# Compact dtypes
+# The rankings are kept with categorical text, the smallest integers that fit and float32 scores, so they take a
+# fraction of the memory and their columns are numeric arrays: only the category labels of the text columns are
+# Python objects, one per distinct value. The workers forked from a preloaded server only read the numeric blocks,
+# which stay shared copy-on-write, where the reference counts of object columns would copy them.
+# The slices that leave the store for a table, figure or export go through display_frame first.
+
+# float32 values widened to the float64 of their shortest decimal, 63.8 instead of 63.79999923706055
+def widen_floats(values):
+    wide = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exponents = np.floor(np.log10(np.abs(wide)))
+    decimals = float32_digits - 1 - np.where(np.isfinite(exponents), exponents, 0)
+    scales = 10.0 ** np.abs(decimals)
+    return np.where(decimals >= 0, np.round(wide * scales) / scales, np.round(wide / scales) * scales)
+
+
+def compact_dtypes(df):
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        if values.dtype == object or isinstance(values.dtype, pd.CategoricalDtype):
+            columns[name] = values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype('category')
+        elif pd.api.types.is_integer_dtype(values):
+            columns[name] = pd.to_numeric(values, downcast='integer')
+        # the CSV parser can be one unit in the last place off the decimal, which float32 does not keep
+        elif values.dtype == np.float64 and np.allclose(widen_floats(values.to_numpy(dtype=np.float32)), values.to_numpy(), rtol=1e-12, atol=0, equal_nan=True):
+            columns[name] = values.astype(np.float32)
+        else:
+            columns[name] = values
+    return pd.DataFrame(columns, index=df.index)
+
+
+# text of a categorical column as objects, looked up by code: astype(object) would convert all the categories of
+# the ranking, not only those of the rows of a slice
+def category_values(values):
+    codes = values.cat.codes.to_numpy()
+    present = codes >= 0
+    result = np.full(len(codes), np.nan, dtype=object)
+    result[present] = values.cat.categories.to_numpy(dtype=object)[codes[present]]
+    return pd.Series(result, index=values.index, name=values.name)
+
+
+# A slice of the rankings with plain dtypes: object text and float64 scores
+def display_frame(df):
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns[name] = category_values(values)
+        elif values.dtype == np.float32:
+            columns[name] = pd.Series(widen_floats(values), index=df.index)
+        else:
+            columns[name] = values
+    return pd.DataFrame(columns, index=df.index)
+
+
+# ranking x year x country cube of a ranking DataFrame, partitioned by year
+def load_country_cube(df, criteria):
+    df = display_frame(df[['Year', 'Country', 'University', 'Overall Score', 'World Rank Order'] + criteria])
+    grouped = df.groupby(['Year', 'Country'], sort=True)
+    cube = grouped.agg(**{
+        'Universities': ('University', 'count'),
+        'Mean Overall Score': ('Overall Score', 'mean'),
+        'Median Overall Score': ('Overall Score', 'median'),
+        'Best World Rank': ('World Rank Order', 'min'),
+    })
+    cube = cube.join(grouped[criteria].mean().add_prefix('Mean ')).round(2).reset_index(level='Country')
+    return {int(year): cube_df.reset_index(drop=True) for year, cube_df in cube.groupby(level='Year', sort=True)}
+
+
+# In-memory data access layer for the ranking DataFrames
+# Every DataFrame is partitioned by year and indexed by university once, so the callbacks
+# never have to scan a full ranking table with boolean masks
+# university_ids maps the universities of every ranking to their canonical ID (see university_index.py),
+# so a university can be looked up in any ranking by the name it has in another one
+# A store is an immutable snapshot of the rankings: a refresh builds a new store and swaps it in, and versions
+# tells the snapshots of a ranking apart, e.g. in the keys of the figure cache
+# university_codes numbers the universities of a ranking densely from 0, aligned with the rows of its partitions,
+# so that the years of a ranking can be aligned with lookup arrays; the IDs stay for URLs and exports
+class RankingStore:
+    # structures built for every ranking, one list item per ranking
+    ranking_attributes = ['partitions', 'university_codes', 'history_frames', 'history_indices', 'history_years', 'country_cubes', 'year_criteria', 'criteria_matrices']
+
+    # previous is the store this one replaces: the structures of the rankings whose DataFrame, criteria and
+    # university IDs are the same in both are taken over instead of built again
+    def __init__(self, rankings_df, rankings_criteria, university_ids=None, versions=None, previous=None):
+        self.rankings_df = rankings_df
+        self.rankings_criteria = rankings_criteria
+        self.versions = tuple(versions or [0] * len(rankings_df))
+        self.university_ids = university_ids or [{name: name for name in df['University'].unique()} for df in rankings_df]
+        # IDs of the names of every ranking, the first ranking that has a name wins
+        self.all_university_ids = {}
+        for ids in reversed(self.university_ids):
+            self.all_university_ids.update(ids)
+        for name in self.ranking_attributes:
+            setattr(self, name, [None] * len(rankings_df))
+
+        for ranking in range(len(rankings_df)):
+            if previous is not None and previous.same_ranking(ranking, rankings_df[ranking], rankings_criteria[ranking], self.university_ids[ranking]):
+                for name in self.ranking_attributes:
+                    getattr(self, name)[ranking] = getattr(previous, name)[ranking]
+            else:
+                self.load_ranking(ranking)
+
+    def same_ranking(self, ranking, df, criteria, ids):
+        return self.rankings_df[ranking] is df and self.rankings_criteria[ranking] == criteria and self.university_ids[ranking] == ids
+
+    def load_ranking(self, ranking):
+        criteria = self.rankings_criteria[ranking]
+        df = self.rankings_df[ranking]
+        df = df.assign(**{'University ID': np.asarray(df['University'].astype(object).map(self.university_ids[ranking]))})
+
+        # (ranking, year) partitions keep the row order of the source file
+        year_indices = df.groupby('Year', sort=True).indices
+        partitions = self.partitions[ranking] = {int(year): df.take(indices).reset_index(drop=True) for year, indices in year_indices.items()}
+        codes = pd.factorize(df['University ID'])[0].astype(np.int32)
+        self.university_codes[ranking] = {int(year): codes[indices] for year, indices in year_indices.items()}
+
+        # university histories are positions into a copy of the table that is already sorted by year
+        history_df = df.sort_values(by=['Year'], ascending=True, kind='stable').reset_index(drop=True)
+        self.history_frames[ranking] = history_df
+        self.history_indices[ranking] = history_df.groupby('University ID', sort=False).indices
+        self.history_years[ranking] = history_df['Year'].to_numpy()
+
+        self.country_cubes[ranking] = load_country_cube(df, criteria)
+
+        # the criteria a ranking published in a year are those with any value in that year
+        year_criteria = self.year_criteria[ranking] = {
+            year: [criterion for criterion in criteria if partition_df[criterion].notna().any()]
+            for year, partition_df in partitions.items()
+        }
+
+        # standardized criteria of every partition, for the similar universities
+        self.criteria_matrices[ranking] = {
+            year: CriteriaMatrix(partition_df[year_criteria[year]].to_numpy(dtype=np.float64))
+            for year, partition_df in partitions.items()
+        }
+
+    def years(self, ranking):
+        return list(self.partitions[ranking].keys())
+
+    # first and last year of all the rankings
+    def year_range(self):
+        years = [year for partitions in self.partitions for year in partitions]
+        return min(years), max(years)
+
+    # criteria of a ranking in a given year, all of them for a year it has no data for
+    def year_columns(self, ranking, year):
+        return self.year_criteria[ranking].get(int(year), self.rankings_criteria[ranking])
+
+    # all universities of a ranking in a given year
+    def partition(self, ranking, year):
+        partition_df = self.partitions[ranking].get(int(year))
+        if partition_df is None:
+            return self.rankings_df[ranking].iloc[0:0].reset_index(drop=True)
+        return partition_df
+
+    # dense codes of the universities of the (ranking, year) partition, in the order of its rows
+    def partition_codes(self, ranking, year):
+        return self.university_codes[ranking].get(int(year), np.zeros(0, dtype=np.int32))
+
+    # canonical ID of a university, looked up in the given ranking first
+    def university_id(self, ranking, university_name):
+        university_id = self.university_ids[ranking].get(university_name)
+        return self.all_university_ids.get(university_name) if university_id is None else university_id
+
+    # all the years of a university in a ranking, sorted by year, whatever the ranking calls it
+    def history(self, ranking, university_name):
+        history_df = self.history_frames[ranking]
+        indices = self.history_indices[ranking].get(self.university_id(ranking, university_name))
+        if indices is None:
+            return history_df.iloc[0:0]
+        return history_df.take(indices)
+
+    # histories of several universities in one DataFrame, in the order of the names and sorted by year, with the
+    # name each one was asked for in the Selection column
+    def histories(self, ranking, university_names):
+        history_df = self.history_frames[ranking]
+        indices = [self.history_indices[ranking].get(self.university_id(ranking, name), ()) for name in university_names]
+        positions = np.concatenate([np.asarray(index, dtype=np.int64) for index in indices]) if indices else np.zeros(0, dtype=np.int64)
+        return history_df.take(positions).assign(Selection=np.repeat(list(university_names), [len(index) for index in indices]))
+
+    # the row of a university in a ranking for a given year, the first one if it is listed twice under two names
+    def university_year(self, ranking, university_name, year):
+        history_df = self.history_frames[ranking]
+        indices = self.history_indices[ranking].get(self.university_id(ranking, university_name))
+        if indices is None:
+            return history_df.iloc[0:0]
+        return history_df.take(indices[self.history_years[ranking][indices] == year][:1])
+
+    # rows of the (ranking, year) partition for the given universities, in ranking order
+    def universities(self, ranking, year, university_names):
+        partition_df = self.partition(ranking, year)
+        return partition_df[partition_df['University'].isin(university_names)]
+
+    # the `count` universities of a ranking in a given year closest to a university by their criteria, closest
+    # first, with their Distance, see similarity.py
+    def similar_universities(self, ranking, university_name, year, count):
+        partition_df = self.partition(ranking, year)
+        ids = partition_df['University ID'].to_numpy()
+        positions = np.flatnonzero(ids == self.university_id(ranking, university_name))
+        if len(positions) == 0:
+            return partition_df.iloc[0:0].assign(Distance=[])
+        nearest, distances = nearest_rows(self.criteria_matrices[ranking][int(year)], ids, positions[0], count)
+        return partition_df.take(nearest).assign(Distance=distances)
+
+    # country metrics of a ranking in a given year, one row per country
+    def country_metrics(self, ranking, year):
+        cube_df = self.country_cubes[ranking].get(int(year))
+        if cube_df is None:
+            return pd.DataFrame(columns=['Country'] + country_base_metrics)
+        return cube_df
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+# A single statement of the DataTable filter syntax, e.g. {Country} ="Japan", {University} icontains harv or {Income} is blank
+FILTER_PART = re.compile(
+    r'^\s*\{(?P<column>(?:[^{}\\]|\\.)+)\}\s*'
+    r'(?P<operator>is\s+(?:blank|nil|num|str)|datestartswith(?![a-z])|[is]?(?:(?:contains|eq|ne|ge|le|gt|lt)(?![a-z])|>=|<=|!=|=|>|<))'
+    r'\s*(?P<value>.*?)\s*$',
+    re.IGNORECASE
+)
+
+OPERATOR_ALIASES = {'eq': '=', 'ne': '!=', 'ge': '>=', 'le': '<=', 'gt': '>', 'lt': '<'}
+
+COMPARISONS = {
+    '=': lambda left, right: left == right,
+    '!=': lambda left, right: left != right,
+    '>=': lambda left, right: left >= right,
+    '<=': lambda left, right: left <= right,
+    '>': lambda left, right: left > right,
+    '<': lambda left, right: left < right,
+}
+
+
+# Splits a statement into (column, operator, case insensitive, value), or None if it is not valid
+def split_filter_part(filter_part):
+    match = FILTER_PART.match(filter_part)
+    if match is None:
+        return None
+
+    column = re.sub(r'\\(.)', r'\1', match.group('column'))
+    operator = re.sub(r'\s+', ' ', match.group('operator').lower())
+    insensitive = False
+    if operator[0] in 'is' and not operator.startswith('is '):
+        insensitive = operator[0] == 'i'
+        operator = operator[1:]
+    operator = OPERATOR_ALIASES.get(operator, operator)
+
+    value_part = match.group('value')
+    if operator.startswith('is '):
+        return (column, operator, insensitive, None) if value_part == '' else None
+    if value_part == '':
+        return None
+
+    if len(value_part) >= 2 and value_part[0] == value_part[-1] and value_part[0] in ('"', "'", '`'):
+        value = value_part[1:-1].replace('\\' + value_part[0], value_part[0])
+    else:
+        try:
+            value = float(value_part)
+        except ValueError:
+            value = value_part
+
+    return column, operator, insensitive, value
+
+
+# Evaluates a single statement against a column, returning a boolean mask
+def filter_mask(series, operator, insensitive, value):
+    if operator == 'is blank':
+        return series.isna() | (series.astype(str) == '')
+    if operator == 'is nil':
+        return series.isna()
+    if operator in ('is num', 'is str'):
+        numbers = series if pd.api.types.is_numeric_dtype(series) else pd.to_numeric(series, errors='coerce')
+        return numbers.notna() if operator == 'is num' else series.notna() & numbers.isna()
+
+    present = series.notna()
+    if operator == 'contains':
+        return present & series.astype(str).str.contains(str(value), case=not insensitive, regex=False)
+    if operator == 'datestartswith':
+        return present & series.astype(str).str.startswith(str(value))
+
+    if isinstance(value, float):
+        numbers = series if pd.api.types.is_numeric_dtype(series) else pd.to_numeric(series, errors='coerce')
+        return COMPARISONS[operator](numbers, value).fillna(False)
+
+    strings = series.astype(str)
+    if insensitive:
+        strings = strings.str.lower()
+        value = value.lower()
+    return present & COMPARISONS[operator](strings, value)
+
+
+# Filters a DataFrame with a DataTable filter_query, statements joined by && are combined with a vectorized AND
+def filter_table(df, filter_query):
+    if not filter_query:
+        return df
+
+    mask = np.ones(len(df), dtype=bool)
+    for filter_part in filter_query.split(' && '):
+        statement = split_filter_part(filter_part)
+        if statement is None or statement[0] not in df.columns:
+            continue
+        column, operator, insensitive, value = statement
+        mask &= filter_mask(df[column], operator, insensitive, value).to_numpy(dtype=bool)
+
+    return df[mask]
+
+
+# Sorts a DataFrame with a DataTable sort_by, sort_columns maps a displayed column to the column it is ordered by
+def sort_table(df, sort_by, sort_columns=None):
+    if not sort_by:
+        return df
+
+    sort_columns = sort_columns or {}
+    columns = []
+    ascending = []
+    for sort in sort_by:
+        column = sort_columns.get(sort['column_id'], sort['column_id'])
+        if column in df.columns:
+            columns.append(column)
+            ascending.append(sort['direction'] == 'asc')
+
+    if not columns:
+        return df
+    return df.sort_values(by=columns, ascending=ascending, kind='stable', na_position='last')
+
+
+# The rows of the current page and the number of pages
+def page_table(df, page_current, page_size):
+    page_count = max(1, math.ceil(len(df) / page_size))
+    page_current = min(max(page_current or 0, 0), page_count - 1)
+    return df.iloc[page_current * page_size:(page_current + 1) * page_size], page_current, page_count
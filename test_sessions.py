@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# Two simulated sessions interleaved through the main dashboard and the university overview
+# The state of a user lives in the dcc.Store components of their page, so the outputs of one session must not
+# depend on the requests of another one. Every session is run alone first, then both are interleaved step by step
+# against the same server, and their outputs must be the ones they had alone.
+#
+# python -m pytest test_sessions.py
+
+import json
+import os
+
+import pytest
+
+os.environ.setdefault('DATASETS_WATCH_SECONDS', '0')
+
+import app as dashboard
+
+session_outputs = ['main-selection.data', 'university-rankings.data', 'university-name.data', 'university-line-chart.figure', 'main-bar-chart.figure']
+
+
+# properties of the components of a freshly loaded page, by '{id}.{property}'
+def initial_session():
+    session = {}
+    for component in dashboard.app.layout._traverse():
+        component_id = getattr(component, 'id', None)
+        if component_id is not None:
+            for prop in component._prop_names:
+                session['{}.{}'.format(component_id, prop)] = getattr(component, prop, None)
+    return session
+
+
+# dispatch the callback of an output like the page does, with the values of the session, and apply its response
+def call_callback(client, session, output, changed):
+    key = next(key for key in dashboard.app.callback_map if output in key.strip('.').split('...'))
+    callback = dashboard.app.callback_map[key]
+    outputs = [dict(zip(('id', 'property'), prop_id.rsplit('.', 1))) for prop_id in key.strip('.').split('...')]
+
+    def dependencies(items):
+        return [dict(item, value=session.get('{}.{}'.format(item['id'], item['property']))) for item in items]
+
+    response = client.post('/_dash-update-component', json={
+        'output': key,
+        'outputs': outputs if key.startswith('..') else outputs[0],
+        'inputs': dependencies(callback['inputs']),
+        'state': dependencies(callback.get('state', [])),
+        'changedPropIds': changed,
+    })
+    if response.status_code == 200:
+        for component_id, props in json.loads(response.data)['response'].items():
+            for prop, value in props.items():
+                session['{}.{}'.format(component_id, prop)] = value
+    return response
+
+
+# (changed properties, outputs of the callbacks they trigger) of a user who switches to a ranking and year,
+# selects table rows, picks the ranking of the overview and opens the overview of a row
+def session_steps(rankings, year, selected_rows, university_rankings, university_row):
+    return [
+        ({'main-rankings.data': rankings.value, 'main-slider.value': year}, ['university-table.data']),
+        ({'university-table.selected_rows': selected_rows}, ['university-table.data', 'main-bar-chart.figure']),
+        ({'university-rankings.data': university_rankings.value}, ['university-modal.is_open']),
+        ({'university-table.active_cell': {'row': university_row, 'column': 1}}, ['university-modal.is_open']),
+    ]
+
+
+def run_step(client, session, step):
+    changes, outputs = step
+    session.update(changes)
+    for output in outputs:
+        assert call_callback(client, session, output, list(changes)).status_code in (200, 204)
+
+
+def snapshot(session):
+    return {prop_id: session.get(prop_id) for prop_id in session_outputs}
+
+
+@pytest.fixture
+def client():
+    return dashboard.server.test_client()
+
+
+@pytest.fixture
+def steps():
+    return {
+        'a': session_steps(dashboard.Rankings.times, 2016, [0, 1], dashboard.Rankings.shanghai, 0),
+        'b': session_steps(dashboard.Rankings.cwur, 2019, [2], dashboard.Rankings.cwur, 3),
+    }
+
+
+def test_interleaved_sessions_stay_independent(client, steps):
+    # outputs of every session after each of its steps, run alone
+    alone = {}
+    for name, name_steps in steps.items():
+        session = initial_session()
+        alone[name] = []
+        for step in name_steps:
+            run_step(client, session, step)
+            alone[name].append(snapshot(session))
+
+    sessions = {name: initial_session() for name in steps}
+    for index in range(len(steps['a'])):
+        for name in steps:
+            run_step(client, sessions[name], steps[name][index])
+            assert snapshot(sessions[name]) == alone[name][index]
+
+    a, b = sessions['a'], sessions['b']
+    assert a['main-selection.data'] != b['main-selection.data']
+    assert a['university-rankings.data'] == dashboard.Rankings.shanghai.value
+    assert b['university-rankings.data'] == dashboard.Rankings.cwur.value
+    assert a['university-name.data'] != b['university-name.data']
+    assert a['university-line-chart.figure'] != b['university-line-chart.figure']
+
+
+def test_session_outputs_follow_their_own_rows(client, steps):
+    for name, name_steps in steps.items():
+        session = initial_session()
+        run_step(client, session, name_steps[0])
+        rows = session['university-table.data']
+        selected_rows = name_steps[1][0]['university-table.selected_rows']
+        university_row = name_steps[3][0]['university-table.active_cell']['row']
+        for step in name_steps[1:]:
+            run_step(client, session, step)
+        assert session['main-selection.data'] == [rows[index]['University'] for index in selected_rows]
+        assert session['university-name.data'] == rows[university_row]['University']
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import json
+import math
+import os
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+import dataset_cache
+
+# Canonical identity of the universities across the rankings
+# The rankings spell the same institution differently ("LMU Munich", "Ludwig Maximilian University of Munich"),
+# so every (ranking, university) is mapped to a university ID: first by normalized name and country, then by a
+# trigram similarity pass between the universities of a country that are not in the same rankings, and finally
+# by the overrides file, which always wins. The ID of a university is a hash of its canonical country and key, so
+# it stays the same when other universities are added. The index is persisted next to the dataset cache.
+
+index_version = 2
+index_path = os.path.join(dataset_cache.cache_dir, 'university-index.json')
+
+# universities of the same country whose trigram cosine similarity is at least this much are the same institution
+default_threshold = 0.75
+
+stop_words = {'the', 'of', 'and', 'at', 'a', 'in', 'de', 'du', 'des', 'la', 'le', 'di', 'del', 'fur'}
+abbreviations = {
+    'univ': 'university', 'universidad': 'university', 'universidade': 'university', 'universitas': 'university',
+    'universite': 'university', 'universitat': 'university', 'universita': 'university', 'universiti': 'university',
+    'inst': 'institute', 'tech': 'technology', 'st': 'saint', 'natl': 'national',
+}
+
+
+# letters that do not decompose into an ASCII letter and an accent
+transliterations = str.maketrans({'ı': 'i', 'ł': 'l', 'Ł': 'L', 'ø': 'o', 'Ø': 'O', 'ß': 'ss', 'đ': 'd', 'Đ': 'D', 'æ': 'ae'})
+
+
+# Lowercase ASCII words without accents, apostrophes, acronyms in parentheses or stop words
+def normalize_name(name):
+    name = re.sub(r'\((?=[^)]*[A-Z]{2})[^)\s]+\)', ' ', str(name).translate(transliterations))
+    name = ''.join(character for character in unicodedata.normalize('NFKD', name) if not unicodedata.combining(character) and unicodedata.category(character) != 'Cf')
+    name = re.sub(r"['’‘`]", '', name).lower().replace('&', ' and ')
+    words = [word.encode('ascii', 'ignore').decode() for word in re.split(r'[\W_]+', name)]
+    words = [abbreviations.get(word, word) for word in words]
+    return ' '.join(word for word in words if word and word not in stop_words)
+
+
+def name_trigrams(name):
+    padded = '  {} '.format(name)
+    return [padded[start:start + 3] for start in range(len(padded) - 2)]
+
+
+# Inverse document frequency of the trigrams of all the names, trigrams that most names share, such as those
+# of "university", weigh little in the similarity
+def trigram_weights(names):
+    counts = collections.Counter(trigram for name in names for trigram in set(name_trigrams(name)))
+    return {trigram: math.log((1 + len(names)) / (1 + count)) + 1 for trigram, count in counts.items()}
+
+
+# TF-IDF weighted character trigrams of names, one L2-normalized row per name
+def trigram_vectors(names, weights):
+    trigrams = [name_trigrams(name) for name in names]
+    vocabulary = {trigram: column for column, trigram in enumerate(sorted({trigram for trigram_list in trigrams for trigram in trigram_list}))}
+    rows = np.repeat(np.arange(len(names)), [len(trigram_list) for trigram_list in trigrams])
+    columns = np.array([vocabulary[trigram] for trigram_list in trigrams for trigram in trigram_list], dtype=np.int64)
+    vectors = np.zeros((len(names), len(vocabulary)), dtype=np.float32)
+    np.add.at(vectors, (rows, columns), 1)
+    vectors *= np.array([weights.get(trigram, 1.0) for trigram in vocabulary], dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+# (similarity, left, right) of the pairs of names at least `threshold` similar, computed by blocks of rows
+def similar_pairs(left_names, right_names, weights, threshold, block_size=1024):
+    vectors = trigram_vectors(list(left_names) + list(right_names), weights)
+    left_vectors, right_vectors = vectors[:len(left_names)], vectors[len(left_names):]
+    pairs = []
+    for start in range(0, len(left_vectors), block_size):
+        similarities = left_vectors[start:start + block_size] @ right_vectors.T
+        rows, columns = np.nonzero(similarities >= threshold)
+        pairs.append((similarities[rows, columns], rows + start, columns))
+    return pairs
+
+
+# Overrides file: CSV with the columns University and Canonical, a university listed in it gets the ID of its
+# canonical name and is left out of the similarity pass, so listing a university as its own canonical name
+# keeps it apart from similar names
+def read_overrides(path):
+    if path is None or not os.path.exists(path):
+        return {}
+    overrides_df = pd.read_csv(path, dtype=str).dropna(subset=['University', 'Canonical'])
+    return dict(zip(overrides_df['University'], overrides_df['Canonical']))
+
+
+# Groups of (ranking, university) that refer to the same institution
+def match_universities(rankings_df, overrides=None, threshold=default_threshold):
+    overrides = overrides or {}
+
+    # one entry per (ranking, university), with the first country it is listed in
+    entries = pd.concat([
+        df[['University', 'Country']].astype(object).groupby('University', sort=False)['Country'].first().reset_index().assign(ranking=ranking)
+        for ranking, df in enumerate(rankings_df)
+    ], ignore_index=True)
+    entries['Country'] = entries['Country'].fillna('')
+    entries['key'] = entries['University'].map(lambda name: normalize_name(overrides.get(name, name)))
+    pinned = set(entries.loc[entries['University'].isin(overrides), 'key'])
+
+    # exact pass: same normalized name in the same country
+    groups = entries.groupby(['Country', 'key'], sort=True).ngroup().to_numpy()
+    parents = np.arange(groups.max() + 1 if len(groups) else 0)
+
+    def find(group):
+        while parents[group] != group:
+            parents[group] = parents[parents[group]]
+            group = parents[group]
+        return group
+
+    group_rankings = [set() for _ in parents]
+    for group, ranking in zip(groups, entries['ranking']):
+        group_rankings[group].add(ranking)
+
+    # similarity pass: within a country, between groups listed in disjoint sets of rankings
+    group_countries = entries.groupby(groups)['Country'].first()
+    group_keys = entries.groupby(groups)['key'].first()
+    weights = trigram_weights(group_keys)
+    blocks = {}
+    for group, country, key in zip(group_keys.index, group_countries, group_keys):
+        if country != '' and key not in pinned and len(group_rankings[group]) < len(rankings_df):
+            blocks.setdefault((country, tuple(sorted(group_rankings[group]))), []).append(group)
+
+    similarities, lefts, rights = [np.zeros(0)], [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)]
+    for (left_country, left_rankings), left_groups in blocks.items():
+        for (right_country, right_rankings), right_groups in blocks.items():
+            if left_country != right_country or left_rankings >= right_rankings or set(left_rankings) & set(right_rankings):
+                continue
+            for pair_similarities, rows, columns in similar_pairs(group_keys[left_groups], group_keys[right_groups], weights, threshold):
+                similarities.append(pair_similarities)
+                lefts.append(np.asarray(left_groups)[rows])
+                rights.append(np.asarray(right_groups)[columns])
+
+    # the most similar pairs are merged first
+    similarities, lefts, rights = np.concatenate(similarities), np.concatenate(lefts), np.concatenate(rights)
+    for index in np.lexsort((rights, lefts, -similarities)):
+        left, right = find(lefts[index]), find(rights[index])
+        if left != right and not group_rankings[left] & group_rankings[right]:
+            parents[right] = left
+            group_rankings[left] |= group_rankings[right]
+
+    entries['group'] = [find(group) for group in groups]
+    return entries
+
+
+# ID of a canonical "<country>|<key>": the first 48 bits of its sha1, which JSON numbers keep exactly
+def stable_id(canonical):
+    return int(hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:12], 16)
+
+
+# Persisted index: university ID of every (ranking, university), rebuilt when a source or the overrides changed
+def load_university_index(rankings_df, sources, overrides_path=None, path=index_path, threshold=default_threshold):
+    fingerprint = {
+        'version': index_version,
+        'threshold': threshold,
+        'sources': [dataset_cache.file_fingerprint(source) for source in sources],
+        'overrides': dataset_cache.file_fingerprint(overrides_path) if overrides_path and os.path.exists(overrides_path) else None,
+    }
+    try:
+        with open(path) as f:
+            index = json.load(f)
+        if index['fingerprint'] == fingerprint:
+            return [dict(zip(names, ids)) for names, ids in index['rankings']]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    entries = match_universities(rankings_df, read_overrides(overrides_path), threshold)
+    # the canonical name of a group is its smallest (country, key), so its ID does not depend on the order of the
+    # files nor on the other universities
+    canonical = (entries['Country'] + '|' + entries['key']).groupby(entries['group']).min().sort_values()
+    ids, used = {}, set()
+    for group, name in canonical.items():
+        university_id = stable_id(name)
+        # a hash collision, as unlikely as it is, takes the next free ID
+        while university_id in used:
+            university_id += 1
+        used.add(university_id)
+        ids[group] = university_id
+    entries['id'] = entries['group'].map(ids)
+    rankings = [
+        (ranking_entries['University'].tolist(), ranking_entries['id'].tolist())
+        for _, ranking_entries in entries.groupby('ranking', sort=True)
+    ]
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'rankings': rankings}, f)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass
+    return [dict(zip(names, ids)) for names, ids in rankings]
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+# Background warm-up of the figure cache
+# A task is a memoized builder (see FigureCache.memoize) and its arguments after the store. The figures are built
+# in a pool of worker processes forked from the server, which share its RankingStore copy-on-write instead of
+# loading the datasets again, and put into the figure cache of the server as they come back, while the server
+# keeps answering requests. Where processes cannot be forked the figures are built in the warm-up thread.
+# A worker forked from a preloaded server (gunicorn --preload) inherits the figures built before the fork but not
+# the warm-up thread, so it starts a warm-up of its own on its first request and builds the missing figures in a
+# thread while it serves.
+
+logger = logging.getLogger(__name__)
+
+# current RankingStore of the server, set before the workers are forked so that they inherit it
+worker_state = {}
+
+
+def build_figure(builder, args, versions):
+    store = worker_state['get_store']()
+    # the rankings changed since the task was queued, its figure would be cached under a stale key
+    if store.versions != versions:
+        return None
+    return builder.uncached(store, *args)
+
+
+class Warmup:
+    def __init__(self, figure_cache, get_store, workers=None):
+        self.figure_cache = figure_cache
+        self.get_store = get_store
+        self.workers = workers
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.seconds = 0.0
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def progress(self):
+        return {'total': self.total, 'done': self.done, 'failed': self.failed, 'seconds': round(self.seconds, 3)}
+
+    # builds the figures of the tasks in a background thread and returns at once
+    # with fork the workers are forked here, so it is only set before the server starts threads that could hold locks
+    def start(self, tasks, fork=True):
+        tasks = list(tasks)
+        self.total += len(tasks)
+        self.pid = os.getpid()
+        worker_state['get_store'] = self.get_store
+        if fork and 'fork' in multiprocessing.get_all_start_methods():
+            executor = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+            # a fork context starts all the workers on the first submit
+            executor.submit(int)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.thread = threading.Thread(target=self.run, args=(executor, tasks), name='figure-warmup', daemon=True)
+        self.thread.start()
+        return self.thread
+
+    # starts the warm-up of the tasks returned by load_tasks in the calling process unless it already ran there,
+    # in the warm-up thread as the process already serves
+    def start_process(self, load_tasks):
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                # the progress inherited from the forking process is not the one of this process
+                self.total, self.done, self.failed, self.seconds = 0, 0, 0, 0.0
+                self.start(load_tasks(), fork=False)
+
+    def run(self, executor, tasks):
+        start = time.perf_counter()
+        store = self.get_store()
+        # figures that are already cached, e.g. requested in the meantime, are not built again
+        queued = len(tasks)
+        tasks = {builder.cache_key(store, *args): (builder, args) for builder, args in tasks}
+        tasks = [task for key, task in tasks.items() if key not in self.figure_cache]
+        self.done += queued - len(tasks)
+        logger.info('Warming up %d figures', len(tasks))
+
+        with executor:
+            futures = {executor.submit(build_figure, builder, args, store.versions): (builder, args) for builder, args in tasks}
+            for future in concurrent.futures.as_completed(futures):
+                builder, args = futures[future]
+                try:
+                    fig = future.result()
+                    if fig is not None:
+                        self.figure_cache.put(builder.cache_key(store, *args), fig)
+                except Exception:
+                    self.failed += 1
+                    logger.exception('Warming up %s%r failed', builder.__name__, args)
+                self.done += 1
+                self.seconds = time.perf_counter() - start
+                if self.done % 50 == 0 or self.done == self.total:
+                    logger.info('Warmed up %d/%d figures in %.1f s', self.done, self.total, self.seconds)